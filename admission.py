@@ -0,0 +1,230 @@
+import asyncio
+import heapq
+import itertools
+import math
+import re
+import time
+from collections import Counter, OrderedDict
+from typing import Iterable, Optional, Tuple
+
+from starlette.responses import JSONResponse
+
+from database import POOL_SIZE
+
+# Одновременно выполняемые запросы не превышают размер пула соединений
+MAX_IN_FLIGHT = POOL_SIZE
+# Сколько запросов может ждать свободного места
+MAX_QUEUE = 64
+# Тяжелые запросы отбрасываются раньше: когда очередь заполнена на эту долю
+HEAVY_QUEUE_SHARE = 0.5
+# Максимальное время ожидания в очереди (секунды)
+QUEUE_TIMEOUT = 2.0
+# Токен-бакет на клиента: запросов в секунду и размер всплеска
+CLIENT_RATE = 20.0
+CLIENT_BURST = 40
+# Сколько клиентов помнить одновременно
+MAX_TRACKED_CLIENTS = 10000
+# Адреса обратных прокси, которым разрешено передавать X-Forwarded-For.
+# От остальных заголовок игнорируется: иначе клиент получал бы новый бакет на каждый запрос
+TRUSTED_PROXIES = frozenset()
+# Начальная оценка времени обработки запроса и вес нового замера в скользящем среднем
+INITIAL_SERVICE_TIME = 0.05
+SERVICE_TIME_WEIGHT = 0.1
+
+PRIORITY_CHEAP = 0
+PRIORITY_HEAVY = 1
+
+# Детальные запросы и ответы из индексов в памяти дешевые, списки с фильтрами — тяжелые
+_CHEAP_PATHS = re.compile(
+    r"^/cf/(contests/\d+|problems/\d+|problems/\d+/history|problems/random|tags/.*|live/contests)$"
+)
+# Потоки событий живут долго и не держат соединение с базой: место в лимите им не нужно
+_STREAMING_PATHS = re.compile(r"^/cf/live/contests/\d+$")
+
+
+def request_priority(path: str) -> int:
+    return PRIORITY_CHEAP if _CHEAP_PATHS.match(path) else PRIORITY_HEAVY
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, burst: float, now: float):
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, rate: float, burst: float, now: float) -> float:
+        """Списывает токен; возвращает 0 или сколько секунд ждать следующего"""
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / rate
+
+
+class AdmissionController:
+    """Глобальный лимит одновременных запросов, очередь с приоритетами и лимиты на клиента"""
+
+    def __init__(
+            self,
+            max_in_flight: int = MAX_IN_FLIGHT,
+            max_queue: int = MAX_QUEUE,
+            queue_timeout: float = QUEUE_TIMEOUT,
+            client_rate: float = CLIENT_RATE,
+            client_burst: float = CLIENT_BURST
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+
+        self.in_flight = 0
+        self.admitted = 0
+        self.service_time = INITIAL_SERVICE_TIME
+        self.rejected: Counter = Counter()
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    def check_client(self, client: str) -> float:
+        now = time.monotonic()
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = self._buckets[client] = TokenBucket(self.client_burst, now)
+            if len(self._buckets) > MAX_TRACKED_CLIENTS:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client)
+        return bucket.take(self.client_rate, self.client_burst, now)
+
+    async def acquire(self, priority: int) -> Optional[str]:
+        """Занимает место; возвращает причину отказа или None"""
+        if self.in_flight < self.max_in_flight and not self.queue_depth:
+            self.in_flight += 1
+            self.admitted += 1
+            return None
+
+        depth = self.queue_depth
+        limit = self.max_queue if priority == PRIORITY_CHEAP else int(self.max_queue * HEAVY_QUEUE_SHARE)
+        if depth >= limit:
+            return "queue_full"
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except asyncio.TimeoutError:
+            # release() мог передать место одновременно с таймаутом: место уже наше
+            if not (future.done() and not future.cancelled()):
+                return "queue_timeout"
+        except asyncio.CancelledError:
+            # Клиент ушел, но переданное ему место нужно вернуть
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+        self.admitted += 1
+        return None
+
+    def release(self, service_time: Optional[float] = None):
+        if service_time is not None:
+            self.service_time += (service_time - self.service_time) * SERVICE_TIME_WEIGHT
+        # Место передается следующему ожидающему с наивысшим приоритетом
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(True)
+                return
+        self.in_flight -= 1
+
+    def retry_after(self) -> int:
+        """Через сколько секунд разойдется текущая очередь при среднем времени обработки"""
+        drain = (self.queue_depth + 1) * self.service_time / self.max_in_flight
+        return max(1, math.ceil(drain))
+
+    def render_metrics(self) -> str:
+        lines = [
+            "# TYPE cfsystem_requests_in_flight gauge",
+            f"cfsystem_requests_in_flight {self.in_flight}",
+            "# TYPE cfsystem_admission_queue_depth gauge",
+            f"cfsystem_admission_queue_depth {self.queue_depth}",
+            "# TYPE cfsystem_requests_admitted_total counter",
+            f"cfsystem_requests_admitted_total {self.admitted}",
+            "# TYPE cfsystem_requests_rejected_total counter",
+        ]
+        for reason in ("rate_limited", "queue_full", "queue_timeout"):
+            lines.append(f'cfsystem_requests_rejected_total{{reason="{reason}"}} {self.rejected[reason]}')
+        return "\n".join(lines) + "\n"
+
+
+class AdmissionMiddleware:
+    """ASGI-middleware: отвечает 429 с Retry-After до того, как запрос займет соединение с базой"""
+
+    def __init__(
+            self,
+            app,
+            controller: AdmissionController,
+            prefix: str = "/cf/",
+            trusted_proxies: Iterable[str] = TRUSTED_PROXIES
+    ):
+        self.app = app
+        self.controller = controller
+        self.prefix = prefix
+        self.trusted_proxies = frozenset(trusted_proxies)
+
+    def client_id(self, scope) -> str:
+        """Адрес клиента: соединения или, за доверенным прокси, первый недоверенный в X-Forwarded-For"""
+        client: Optional[Tuple[str, int]] = scope.get("client")
+        peer = client[0] if client else "unknown"
+        if peer not in self.trusted_proxies:
+            return peer
+        forwarded = [
+            value.decode("latin-1")
+            for name, value in scope.get("headers", ())
+            if name == b"x-forwarded-for"
+        ]
+        # Каждый прокси дописывает адрес справа, поэтому идем от конца цепочки
+        for address in reversed([part.strip() for part in ",".join(forwarded).split(",") if part.strip()]):
+            if address not in self.trusted_proxies:
+                return address
+        return peer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.prefix):
+            await self.app(scope, receive, send)
+            return
+
+        controller = self.controller
+        wait = controller.check_client(self.client_id(scope))
+        if wait:
+            await self._reject(scope, receive, send, "rate_limited", max(1, math.ceil(wait)))
+            return
+
+        if _STREAMING_PATHS.match(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        reason = await controller.acquire(request_priority(scope["path"]))
+        if reason is not None:
+            await self._reject(scope, receive, send, reason, controller.retry_after())
+            return
+
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            controller.release(time.monotonic() - started)
+
+    async def _reject(self, scope, receive, send, reason: str, retry_after: int):
+        self.controller.rejected[reason] += 1
+        response = JSONResponse(
+            {"detail": "Too Many Requests"},
+            status_code=429,
+            headers={"Retry-After": str(retry_after)}
+        )
+        await response(scope, receive, send)
@@ -0,0 +1,307 @@
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import aiohttp
+from sqlalchemy import select, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from database import DATABASE_PATH
+from fill_db import (
+    DEFAULT_LANGUAGES, WRITE_BATCH_SIZE, ssl_context, get_finished_contests,
+    load_problemset_statistics, run_pipeline, share_api_limiter
+)
+from models import Language, CFProblemStatistics
+from init_db import create_schema
+from timeseries import record_solved_counts, apply_retention
+from documents import materialize_all_documents
+from snapshot import write_snapshot
+from bitmaps import rebuild_solved_bitmaps
+
+logger = logging.getLogger(__name__)
+
+# Параметры полной загрузки
+DEFAULT_WORKERS = os.cpu_count() or 1
+SHARD_FETCH_WORKERS = 2
+STAGING_DIR = "staging"
+# SQLite по умолчанию позволяет присоединить не больше 10 баз
+MAX_ATTACHED_SHARDS = 8
+# Контесты, которые не удалось загрузить; --retry-failed загружает только их
+FAILED_CONTESTS_FILE = "failed_contests.json"
+
+# Слияние одной промежуточной базы в основную. Идентификаторы в шардах свои,
+# поэтому связи переносятся через естественные ключи: problem_uid, имя тега, cf_contest_id.
+MERGE_STATEMENTS = [
+    """
+    INSERT INTO main.languages (code, name)
+    SELECT code, name FROM {shard}.languages WHERE true
+    ON CONFLICT DO NOTHING
+    """,
+    """
+    INSERT INTO main.cf_contests (cf_contest_id, name, type, phase, start_time, duration, contest_url)
+    SELECT cf_contest_id, name, type, phase, start_time, duration, contest_url
+    FROM {shard}.cf_contests WHERE true
+    ON CONFLICT (cf_contest_id) DO UPDATE SET
+        name = excluded.name, type = excluded.type, phase = excluded.phase,
+        start_time = excluded.start_time, duration = excluded.duration,
+        contest_url = excluded.contest_url
+    """,
+    """
+    INSERT INTO main.cf_tags (name)
+    SELECT name FROM {shard}.cf_tags WHERE true
+    ON CONFLICT (name) DO NOTHING
+    """,
+    """
+    INSERT INTO main.cf_problems (problem_uid, cf_problem_index, name, rating, problem_url)
+    SELECT problem_uid, cf_problem_index, name, rating, problem_url
+    FROM {shard}.cf_problems WHERE true
+    ON CONFLICT (problem_uid) DO UPDATE SET
+        cf_problem_index = excluded.cf_problem_index, name = excluded.name,
+        rating = excluded.rating, problem_url = excluded.problem_url
+    """,
+    """
+    INSERT OR IGNORE INTO main.cf_problem_tag_association (problem_id, tag_id)
+    SELECT p.id, t.id
+    FROM {shard}.cf_problem_tag_association a
+    JOIN {shard}.cf_problems sp ON sp.id = a.problem_id
+    JOIN main.cf_problems p ON p.problem_uid = sp.problem_uid
+    JOIN {shard}.cf_tags st ON st.id = a.tag_id
+    JOIN main.cf_tags t ON t.name = st.name
+    """,
+    """
+    INSERT OR IGNORE INTO main.cf_problem_language_association (problem_id, language_code)
+    SELECT p.id, a.language_code
+    FROM {shard}.cf_problem_language_association a
+    JOIN {shard}.cf_problems sp ON sp.id = a.problem_id
+    JOIN main.cf_problems p ON p.problem_uid = sp.problem_uid
+    """,
+    """
+    INSERT OR IGNORE INTO main.cf_problem_contest_association (problem_id, contest_id)
+    SELECT p.id, c.id
+    FROM {shard}.cf_problem_contest_association a
+    JOIN {shard}.cf_problems sp ON sp.id = a.problem_id
+    JOIN main.cf_problems p ON p.problem_uid = sp.problem_uid
+    JOIN {shard}.cf_contests sc ON sc.id = a.contest_id
+    JOIN main.cf_contests c ON c.cf_contest_id = sc.cf_contest_id
+    """,
+    """
+    CREATE TEMP TABLE merged_statistics AS
+    SELECT p.id AS problem_id, c.id AS contest_id, s.solved_count, s.last_updated
+    FROM {shard}.cf_problem_statistics s
+    JOIN {shard}.cf_problems sp ON sp.id = s.problem_id
+    JOIN main.cf_problems p ON p.problem_uid = sp.problem_uid
+    JOIN {shard}.cf_contests sc ON sc.id = s.contest_id
+    JOIN main.cf_contests c ON c.cf_contest_id = sc.cf_contest_id
+    """,
+    """
+    UPDATE main.cf_problem_statistics
+    SET solved_count = m.solved_count, last_updated = m.last_updated
+    FROM merged_statistics m
+    WHERE cf_problem_statistics.problem_id = m.problem_id
+      AND cf_problem_statistics.contest_id = m.contest_id
+    """,
+    """
+    INSERT INTO main.cf_problem_statistics (problem_id, contest_id, solved_count, last_updated)
+    SELECT m.problem_id, m.contest_id, m.solved_count, m.last_updated
+    FROM merged_statistics m
+    WHERE NOT EXISTS (
+        SELECT 1 FROM main.cf_problem_statistics s
+        WHERE s.problem_id = m.problem_id AND s.contest_id = m.contest_id
+    )
+    """,
+    "DROP TABLE merged_statistics",
+]
+
+
+async def create_database(engine):
+    """Создание таблиц и справочника языков"""
+    async with engine.begin() as conn:
+        await conn.run_sync(create_schema)
+        await conn.execute(
+            sqlite_insert(Language.__table__).on_conflict_do_nothing(),
+            [{'code': code, 'name': code} for code in DEFAULT_LANGUAGES]
+        )
+
+
+async def _backfill_shard(shard_index, contests, statistics, staging_path, fetch_workers):
+    if os.path.exists(staging_path):
+        os.remove(staging_path)
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{staging_path}")
+    await create_database(engine)
+    db_session = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+
+    conn = aiohttp.TCPConnector(ssl=ssl_context)
+    async with aiohttp.ClientSession(connector=conn) as http_session:
+        logger.info(f"Shard {shard_index}: {len(contests)} contests -> {staging_path}")
+        # Документы и замеры solved_count пишутся один раз после слияния, когда известны итоговые id
+        failed = await run_pipeline(
+            http_session, db_session, contests, statistics, fetch_workers, materialize=False, history=False
+        )
+
+    await engine.dispose()
+    return failed
+
+
+def backfill_shard(shard_index, contests, statistics, staging_path, fetch_workers=SHARD_FETCH_WORKERS):
+    """Точка входа рабочего процесса: загрузка своей доли контестов в отдельную базу.
+
+    Возвращает id контестов, которые не удалось загрузить.
+    """
+    logging.getLogger('sqlalchemy.engine').setLevel(logging.WARNING)
+    return asyncio.run(_backfill_shard(shard_index, contests, statistics, staging_path, fetch_workers))
+
+
+async def merge_shards(engine, staging_paths):
+    """Слияние промежуточных баз в основную множественными INSERT ... SELECT"""
+    for start in range(0, len(staging_paths), MAX_ATTACHED_SHARDS):
+        group = staging_paths[start:start + MAX_ATTACHED_SHARDS]
+        aliases = [f"shard_{start + i}" for i in range(len(group))]
+
+        async with engine.connect() as conn:
+            # ATTACH нельзя выполнять внутри транзакции, поэтому присоединяем до первой записи
+            for alias, path in zip(aliases, group):
+                await conn.execute(text(f"ATTACH DATABASE :path AS {alias}"), {'path': path})
+            for alias in aliases:
+                for statement in MERGE_STATEMENTS:
+                    await conn.execute(text(statement.format(shard=alias)))
+            await conn.commit()
+            for alias in aliases:
+                await conn.execute(text(f"DETACH DATABASE {alias}"))
+
+        logger.info(f"Merged {len(group)} shards into {DATABASE_PATH}")
+
+
+async def record_history(engine):
+    """Замер solved_count для всего каталога после слияния.
+
+    В той же транзакции пересобираются битовые карты хэндлов: слитые задачи получили новые id.
+    """
+    db_session = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    async with db_session() as session:
+        samples = (await session.execute(
+            select(CFProblemStatistics.problem_id, CFProblemStatistics.contest_id, CFProblemStatistics.solved_count)
+            .where(CFProblemStatistics.contest_id.is_not(None))
+        )).all()
+        for start in range(0, len(samples), WRITE_BATCH_SIZE):
+            await record_solved_counts(session, [tuple(row) for row in samples[start:start + WRITE_BATCH_SIZE]])
+        await apply_retention(session)
+        await rebuild_solved_bitmaps(session)
+        await session.commit()
+
+
+async def record_documents(engine):
+    """Детальные ответы для всего каталога: id в шардах свои, поэтому документы собираются после слияния"""
+    db_session = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    async with db_session() as session:
+        await materialize_all_documents(session)
+        await session.commit()
+
+
+async def record_snapshot(engine):
+    """Снимок каталога для воркеров API; они переключаются на него при следующей проверке версии"""
+    db_session = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    async with db_session() as session:
+        await write_snapshot(session)
+
+
+def read_failed_contests(staging_dir):
+    path = os.path.join(staging_dir, FAILED_CONTESTS_FILE)
+    if not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return set(json.load(f))
+
+
+def write_failed_contests(staging_dir, failed):
+    path = os.path.join(staging_dir, FAILED_CONTESTS_FILE)
+    if failed:
+        with open(path, "w") as f:
+            json.dump(sorted(failed), f)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+async def backfill(workers=DEFAULT_WORKERS, gym=False, staging_dir=STAGING_DIR, keep_staging=False, retry_failed=False):
+    """Полная загрузка каталога: контесты делятся между процессами, затем шарды сливаются"""
+    # spawn: дочерние процессы не должны наследовать работающий цикл событий
+    context = multiprocessing.get_context('spawn')
+    # Слот следующего запроса к API общий для основного процесса и всех рабочих
+    next_slot = context.Value('d', 0.0)
+    share_api_limiter(next_slot)
+
+    only = read_failed_contests(staging_dir) if retry_failed else None
+    if retry_failed and not only:
+        logger.info("No failed contests to retry")
+        return
+
+    conn = aiohttp.TCPConnector(ssl=ssl_context)
+    async with aiohttp.ClientSession(connector=conn) as http_session:
+        contests = await get_finished_contests(http_session)
+        if gym:
+            contests += await get_finished_contests(http_session, gym=True)
+        statistics = await load_problemset_statistics(http_session)
+
+    if only is not None:
+        contests = [contest for contest in contests if contest['id'] in only]
+    if not contests:
+        logger.error("No contests found")
+        return
+
+    contests = sorted({contest['id']: contest for contest in contests}.values(), key=lambda contest: contest['id'])
+    shards = [contests[i::workers] for i in range(workers)]
+    shards = [shard for shard in shards if shard]
+    os.makedirs(staging_dir, exist_ok=True)
+    staging_paths = [os.path.join(staging_dir, f"shard_{i}.db") for i in range(len(shards))]
+    logger.info(f"Backfilling {len(contests)} contests with {len(shards)} workers")
+
+    loop = asyncio.get_running_loop()
+    with ProcessPoolExecutor(
+            max_workers=len(shards), mp_context=context, initializer=share_api_limiter, initargs=(next_slot,)
+    ) as pool:
+        shard_failures = await asyncio.gather(*(
+            loop.run_in_executor(pool, backfill_shard, i, shard, statistics, path)
+            for i, (shard, path) in enumerate(zip(shards, staging_paths))
+        ))
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{DATABASE_PATH}")
+    try:
+        await create_database(engine)
+        await merge_shards(engine, staging_paths)
+        await record_history(engine)
+        await record_documents(engine)
+        await record_snapshot(engine)
+    finally:
+        await engine.dispose()
+
+    if not keep_staging:
+        for path in staging_paths:
+            os.remove(path)
+
+    failed = {contest_id for shard_failed in shard_failures for contest_id in shard_failed}
+    write_failed_contests(staging_dir, failed)
+    if failed:
+        logger.error(
+            f"{len(failed)} contests failed and were saved to {os.path.join(staging_dir, FAILED_CONTESTS_FILE)}; "
+            f"rerun with --retry-failed"
+        )
+    logger.info(f"Backfill completed. Database updated at {DATABASE_PATH}")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Полная загрузка каталога Codeforces")
+    arg_parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Количество процессов")
+    arg_parser.add_argument("--gym", action="store_true", help="Загружать также тренировки gym")
+    arg_parser.add_argument("--staging-dir", default=STAGING_DIR, help="Каталог для промежуточных баз")
+    arg_parser.add_argument("--keep-staging", action="store_true", help="Не удалять промежуточные базы")
+    arg_parser.add_argument("--retry-failed", action="store_true", help="Загрузить только контесты, не загруженные в прошлый раз")
+    args = arg_parser.parse_args()
+
+    logging.getLogger('sqlalchemy.engine').setLevel(logging.WARNING)
+    asyncio.run(backfill(args.workers, args.gym, args.staging_dir, args.keep_staging, args.retry_failed))
@@ -0,0 +1,76 @@
+from typing import Iterable, List, Optional
+
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import CFProblem, CFTrackedHandle
+
+# Битовые карты по cf_problems.id. В памяти это int (операции над множествами
+# выполняются целиком на стороне Python), в базе — байты little-endian.
+# id задач не переживают пересоздание каталога, поэтому карта — производные данные:
+# источник истины — problem_uid в solved_uids, карта пересобирается при каждой синхронизации.
+
+
+def ids_to_bitmap(ids: Iterable[int]) -> int:
+    # Биты выставляются в bytearray: OR с большим int на каждый id был бы квадратичным
+    data = bytearray()
+    for problem_id in ids:
+        position = problem_id >> 3
+        if position >= len(data):
+            data.extend(bytes(position + 1 - len(data)))
+        data[position] |= 1 << (problem_id & 7)
+    return bitmap_from_bytes(bytes(data))
+
+
+# Номера установленных битов для каждого значения байта
+_BYTE_BITS = [tuple(bit for bit in range(8) if value >> bit & 1) for value in range(256)]
+
+
+def bitmap_to_ids(bitmap: int) -> List[int]:
+    """Номера установленных битов за один проход по байтам: время линейно от размера карты"""
+    ids = []
+    for position, byte in enumerate(bitmap_to_bytes(bitmap)):
+        if byte:
+            base = position * 8
+            ids.extend(base + bit for bit in _BYTE_BITS[byte])
+    return ids
+
+
+def bitmap_from_bytes(data: Optional[bytes]) -> int:
+    return int.from_bytes(data or b'', 'little')
+
+
+def bitmap_to_bytes(bitmap: int) -> bytes:
+    return bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+
+
+def split_uids(data: Optional[str]) -> set:
+    return set(filter(None, (data or '').split(',')))
+
+
+def join_uids(uids: Iterable[str]) -> str:
+    return ','.join(sorted(uids))
+
+
+async def rebuild_solved_bitmaps(session: AsyncSession, handle_ids: Optional[List[int]] = None):
+    """Пересборка битовых карт хэндлов из solved_uids по текущим cf_problems.id"""
+    query = select(CFTrackedHandle.id, CFTrackedHandle.solved_uids)
+    if handle_ids is not None:
+        query = query.where(CFTrackedHandle.id.in_(handle_ids))
+    handles = (await session.execute(query)).all()
+    if not handles:
+        return
+
+    problem_ids = dict((await session.execute(select(CFProblem.problem_uid, CFProblem.id))).all())
+    rows = []
+    for handle_id, solved_uids in handles:
+        bitmap = ids_to_bitmap(problem_ids[uid] for uid in split_uids(solved_uids) if uid in problem_ids)
+        rows.append({'handle_id': handle_id, 'bitmap': bitmap_to_bytes(bitmap), 'count': bitmap.bit_count()})
+
+    table = CFTrackedHandle.__table__
+    await session.execute(
+        update(table)
+        .where(table.c.id == bindparam('handle_id'))
+        .values(solved_bitmap=bindparam('bitmap'), solved_count=bindparam('count')),
+        rows
+    )
@@ -1,16 +1,19 @@
-from datetime import datetime
+import json
+from datetime import datetime, timezone
 
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from sqlalchemy.sql import Select
 from sqlalchemy.orm import selectinload
 from sqlalchemy import and_, or_
 from sqlalchemy.sql import func
 import models
-from typing import List, Optional
+import timeseries
+from bitmaps import bitmap_from_bytes, bitmap_to_ids
+from typing import Dict, List, Optional
 
 
-async def get_cf_contests(
-        db: AsyncSession,
+def cf_contests_query(
         skip: int = 0,
         limit: int = 100,
         name: Optional[str] = None,
@@ -22,7 +25,8 @@ async def get_cf_contests(
         start_time_to: Optional[datetime] = None,
         min_problems: Optional[int] = None,
         max_problems: Optional[int] = None
-) -> List[models.CFContest]:
+) -> Select:
+    """Запрос списка контестов с фильтрами (без выполнения)"""
     # Подзапрос для подсчета задач в каждом контесте
     problem_count = (
         select(
@@ -76,11 +80,40 @@ async def get_cf_contests(
             )
         )
 
-    result = await db.execute(
+    return (
         query.order_by(models.CFContest.start_time.desc())
         .offset(skip)
         .limit(limit)
     )
+
+
+async def get_cf_contests(
+        db: AsyncSession,
+        skip: int = 0,
+        limit: int = 100,
+        name: Optional[str] = None,
+        contest_type: Optional[str] = None,
+        phase: Optional[str] = None,
+        min_duration: Optional[int] = None,
+        max_duration: Optional[int] = None,
+        start_time_from: Optional[datetime] = None,
+        start_time_to: Optional[datetime] = None,
+        min_problems: Optional[int] = None,
+        max_problems: Optional[int] = None
+) -> List[models.CFContest]:
+    result = await db.execute(cf_contests_query(
+        skip=skip,
+        limit=limit,
+        name=name,
+        contest_type=contest_type,
+        phase=phase,
+        min_duration=min_duration,
+        max_duration=max_duration,
+        start_time_from=start_time_from,
+        start_time_to=start_time_to,
+        min_problems=min_problems,
+        max_problems=max_problems
+    ))
     return result.scalars().all()
 
 async def get_cf_contest(db: AsyncSession, contest_id: int) -> Optional[models.CFContest]:
@@ -91,8 +124,13 @@ async def get_cf_contest(db: AsyncSession, contest_id: int) -> Optional[models.C
     return result.scalars().first()
 
 
-async def get_cf_problems(
-        db: AsyncSession,
+def _id_set(ids: List[int]):
+    """Множество id одним параметром через json_each: без лимита на число переменных SQLite"""
+    values = func.json_each(json.dumps(ids)).table_valued('value')
+    return select(values.c.value)
+
+
+def cf_problems_query(
         skip: int = 0,
         limit: int = 100,
         name: Optional[str] = None,
@@ -101,8 +139,10 @@ async def get_cf_problems(
         include_null_rating: bool = False,
         tags: Optional[List[str]] = None,
         contest_id: Optional[int] = None,
-        min_solved_count: Optional[int] = None
-) -> List[models.CFProblem]:
+        min_solved_count: Optional[int] = None,
+        problem_ids: Optional[List[int]] = None
+) -> Select:
+    """Запрос списка задач с фильтрами (без выполнения)"""
     query = select(models.CFProblem)
 
     # Фильтры по рейтингу с учетом NULL значений
@@ -139,18 +179,87 @@ async def get_cf_problems(
     if min_solved_count:
         query = query.join(models.CFProblemStatistics)
         query = query.where(models.CFProblemStatistics.solved_count >= min_solved_count)
+    if problem_ids is not None:
+        query = query.where(models.CFProblem.id.in_(_id_set(problem_ids)))
 
-    result = await db.execute(
+    return (
         query.order_by(models.CFProblem.rating.desc())
         .offset(skip)
         .limit(limit)
-        .options(
+    )
+
+
+async def get_cf_problems(
+        db: AsyncSession,
+        skip: int = 0,
+        limit: int = 100,
+        name: Optional[str] = None,
+        min_rating: Optional[int] = None,
+        max_rating: Optional[int] = None,
+        include_null_rating: bool = False,
+        tags: Optional[List[str]] = None,
+        contest_id: Optional[int] = None,
+        min_solved_count: Optional[int] = None,
+        solved_by: Optional[List[str]] = None,
+        unsolved_by: Optional[List[str]] = None
+) -> Optional[List[models.CFProblem]]:
+    """Список задач; None, если какой-то из хэндлов solved_by/unsolved_by не отслеживается"""
+    problem_ids = None
+    if solved_by or unsolved_by:
+        solved_by = [handle.lower() for handle in solved_by or []]
+        unsolved_by = [handle.lower() for handle in unsolved_by or []]
+        bitmaps = await get_cf_handle_bitmaps(db, solved_by + unsolved_by)
+        if bitmaps is None:
+            return None
+        # Кандидаты — решенные всеми из solved_by, без него — все задачи каталога;
+        # решенные кем-либо из unsolved_by снимаются AND-NOT по той же карте
+        if solved_by:
+            candidates = bitmaps[solved_by[0]]
+            for handle in solved_by[1:]:
+                candidates &= bitmaps[handle]
+        else:
+            max_id = (await db.execute(select(func.max(models.CFProblem.id)))).scalar() or 0
+            # Биты 1..max_id: id задач начинаются с 1
+            candidates = (1 << (max_id + 1)) - 2
+        for handle in unsolved_by:
+            candidates &= ~bitmaps[handle]
+        problem_ids = bitmap_to_ids(candidates)
+
+    query = cf_problems_query(
+        skip=skip,
+        limit=limit,
+        name=name,
+        min_rating=min_rating,
+        max_rating=max_rating,
+        include_null_rating=include_null_rating,
+        tags=tags,
+        contest_id=contest_id,
+        min_solved_count=min_solved_count,
+        problem_ids=problem_ids
+    )
+    result = await db.execute(
+        query.options(
             selectinload(models.CFProblem.tags),
             selectinload(models.CFProblem.statistics)
         )
     )
     return result.scalars().all()
 
+async def get_cf_handle_bitmaps(db: AsyncSession, handles: List[str]) -> Optional[Dict[str, int]]:
+    """Битовые карты решенных задач по хэндлам; None, если какой-то хэндл не отслеживается.
+
+    Хэндлы хранятся в нижнем регистре, ключи результата — тоже.
+    """
+    handles = [handle.lower() for handle in handles]
+    result = await db.execute(
+        select(models.CFTrackedHandle.handle, models.CFTrackedHandle.solved_bitmap)
+        .where(models.CFTrackedHandle.handle.in_(set(handles)))
+    )
+    bitmaps = {handle: bitmap_from_bytes(data) for handle, data in result.all()}
+    if len(bitmaps) < len(set(handles)):
+        return None
+    return bitmaps
+
 async def get_cf_problem(db: AsyncSession, problem_id: int) -> Optional[models.CFProblem]:
     result = await db.execute(
         select(models.CFProblem)
@@ -163,8 +272,7 @@ async def get_cf_problem(db: AsyncSession, problem_id: int) -> Optional[models.C
     return result.scalars().first()
 
 
-async def get_cf_contest_problems(
-        db: AsyncSession,
+def cf_contest_problems_query(
         contest_id: int,
         skip: int = 0,
         limit: int = 100,
@@ -173,7 +281,8 @@ async def get_cf_contest_problems(
         max_rating: Optional[int] = None,
         tags: Optional[List[str]] = None,
         min_solved_count: Optional[int] = None
-) -> List[models.CFProblem]:
+) -> Select:
+    """Запрос задач контеста с фильтрами (без выполнения)"""
     query = (
         select(models.CFProblem)
         .join(models.cf_problem_contest_association)
@@ -196,13 +305,180 @@ async def get_cf_contest_problems(
         query = query.join(models.CFProblemStatistics)
         query = query.where(models.CFProblemStatistics.solved_count >= min_solved_count)
 
-    result = await db.execute(
+    return (
         query.order_by(models.CFProblem.rating)
         .offset(skip)
         .limit(limit)
-        .options(
+    )
+
+
+async def get_cf_contest_problems(
+        db: AsyncSession,
+        contest_id: int,
+        skip: int = 0,
+        limit: int = 100,
+        name: Optional[str] = None,
+        min_rating: Optional[int] = None,
+        max_rating: Optional[int] = None,
+        tags: Optional[List[str]] = None,
+        min_solved_count: Optional[int] = None
+) -> List[models.CFProblem]:
+    query = cf_contest_problems_query(
+        contest_id=contest_id,
+        skip=skip,
+        limit=limit,
+        name=name,
+        min_rating=min_rating,
+        max_rating=max_rating,
+        tags=tags,
+        min_solved_count=min_solved_count
+    )
+    result = await db.execute(
+        query.options(
             selectinload(models.CFProblem.tags),
             selectinload(models.CFProblem.statistics)
         )
     )
     return result.scalars().all()
+
+
+async def get_cf_problem_catalog(db: AsyncSession) -> List:
+    """Плоский список задач для построения индексов в памяти"""
+    result = await db.execute(
+        select(
+            models.CFProblem.id,
+            models.CFProblem.problem_uid,
+            models.CFProblem.cf_problem_index,
+            models.CFProblem.name,
+            models.CFProblem.rating,
+            models.CFProblem.problem_url
+        )
+        .order_by(models.CFProblem.id)
+    )
+    return result.all()
+
+
+async def get_cf_catalog_stamp(db: AsyncSession) -> str:
+    """Отпечаток каталога: экземпляр базы, число задач и наибольший id.
+
+    Меняется при пересоздании базы и при добавлении задач в обход снимка.
+    """
+    instance = (await db.execute(
+        select(models.DatabaseInfo.value).where(models.DatabaseInfo.key == 'instance')
+    )).scalar()
+    count, max_id = (await db.execute(
+        select(func.count(models.CFProblem.id), func.max(models.CFProblem.id))
+    )).one()
+    return f"{instance}:{count}:{max_id}"
+
+
+async def get_cf_problem_tag_pairs(db: AsyncSession) -> List:
+    """Пары (problem_id, имя тега) для построения индексов в памяти"""
+    result = await db.execute(
+        select(
+            models.cf_problem_tag_association.c.problem_id,
+            models.CFTag.name
+        )
+        .join(models.CFTag, models.CFTag.id == models.cf_problem_tag_association.c.tag_id)
+    )
+    return result.all()
+
+
+async def get_cf_tag_counts(db: AsyncSession) -> List:
+    """Теги с количеством задач для индекса подсказок"""
+    result = await db.execute(
+        select(
+            models.CFTag.id,
+            models.CFTag.name,
+            func.count(models.cf_problem_tag_association.c.problem_id).label('problems_count')
+        )
+        .outerjoin(
+            models.cf_problem_tag_association,
+            models.CFTag.id == models.cf_problem_tag_association.c.tag_id
+        )
+        .group_by(models.CFTag.id)
+    )
+    return result.all()
+
+
+async def get_cf_problem_history(
+        db: AsyncSession,
+        problem_id: int,
+        resolution: str = 'day',
+        since: Optional[datetime] = None,
+        contest_id: Optional[int] = None
+) -> List[dict]:
+    """История solved_count: сырые замеры или агрегаты за день/неделю/месяц.
+
+    У задачи ряд на каждый ее контест; точки помечены contest_id, фильтр contest_id оставляет один ряд.
+    """
+    since_ts = int(since.timestamp()) if since else 0
+
+    if resolution == 'raw':
+        chunks = models.CFSolvedCountChunk
+        query = (
+            select(chunks.contest_id, chunks.start_ts, chunks.data)
+            .where(chunks.problem_id == problem_id, chunks.last_ts >= since_ts)
+            .order_by(chunks.contest_id, chunks.start_ts)
+        )
+        if contest_id is not None:
+            query = query.where(chunks.contest_id == contest_id)
+        result = await db.execute(query)
+        return [
+            {'contest_id': series, 'timestamp': datetime.fromtimestamp(ts, tz=timezone.utc), 'solved_count': value}
+            for series, start_ts, data in result.all()
+            for ts, value in timeseries.decode_samples(data, start_ts)
+            if ts >= since_ts
+        ]
+
+    rollups = models.CFSolvedCountRollup
+    query = (
+        select(rollups.contest_id, rollups.period_start, rollups.last_value)
+        .where(
+            rollups.problem_id == problem_id,
+            rollups.period == resolution,
+            rollups.period_start >= timeseries.period_start(resolution, since_ts)
+        )
+        .order_by(rollups.contest_id, rollups.period_start)
+    )
+    if contest_id is not None:
+        query = query.where(rollups.contest_id == contest_id)
+    result = await db.execute(query)
+    return [
+        {'contest_id': series, 'timestamp': timeseries.day_to_datetime(day), 'solved_count': value}
+        for series, day, value in result.all()
+    ]
+
+
+async def get_trending_cf_problems(db: AsyncSession, days: int = 7, limit: int = 20) -> List:
+    """Задачи с наибольшим приростом решений за период (по агрегатам, без сырых замеров)"""
+    # Самые подробные агрегаты, которые хранятся весь запрошенный период
+    period = next(
+        period for period in timeseries.PERIODS
+        if timeseries.RETENTION_DAYS[period] is None or days <= timeseries.RETENTION_DAYS[period]
+    )
+    today = int(datetime.now(timezone.utc).timestamp()) // timeseries.SECONDS_PER_DAY
+
+    rollups = models.CFSolvedCountRollup
+    # Прирост считается по каждому ряду (задача, контест), у задачи берется лучший
+    series_growth = (
+        select(rollups.problem_id, (func.max(rollups.last_value) - func.min(rollups.first_value)).label('growth'))
+        .where(rollups.period == period, rollups.period_start >= today - days)
+        .group_by(rollups.problem_id, rollups.contest_id)
+        .subquery()
+    )
+    growth = func.max(series_growth.c.growth).label('growth')
+    trending = (
+        select(series_growth.c.problem_id, growth)
+        .group_by(series_growth.c.problem_id)
+        .order_by(growth.desc())
+        .limit(limit)
+        .subquery()
+    )
+
+    result = await db.execute(
+        select(models.CFProblem, trending.c.growth)
+        .join(trending, models.CFProblem.id == trending.c.problem_id)
+        .order_by(trending.c.growth.desc())
+    )
+    return result.all()
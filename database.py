@@ -14,7 +14,13 @@ convention = {
 metadata = MetaData(naming_convention=convention)
 Base = declarative_base(metadata=metadata)
 
-SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./test_youit.db"
+DATABASE_PATH = "./test_youit.db"
+SQLALCHEMY_DATABASE_URL = f"sqlite+aiosqlite:///{DATABASE_PATH}"
+
+# Параметры пула соединений (лимит одновременных запросов в admission.py опирается на POOL_SIZE)
+POOL_SIZE = 20
+MAX_OVERFLOW = 10
+POOL_TIMEOUT = 5
 
 # engine = create_async_engine(
 #     SQLALCHEMY_DATABASE_URL,
@@ -24,9 +30,9 @@ SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./test_youit.db"
 engine = create_async_engine(
     SQLALCHEMY_DATABASE_URL,
     echo=True,
-    pool_size=20,
-    max_overflow=10,
-    pool_timeout=30,
+    pool_size=POOL_SIZE,
+    max_overflow=MAX_OVERFLOW,
+    pool_timeout=POOL_TIMEOUT,
     pool_recycle=3600
 )
 
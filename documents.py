@@ -0,0 +1,118 @@
+import hashlib
+from functools import lru_cache
+from typing import Any, Iterable, List, Optional, Set, Tuple
+
+from pydantic import TypeAdapter
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+import models
+import schemas
+
+# Сколько объектов загружается и рендерится за один запрос
+DOCUMENT_BATCH_SIZE = 500
+
+CONTEST = 'contest'
+PROBLEM = 'problem'
+
+
+@lru_cache(maxsize=None)
+def adapter(model):
+    return TypeAdapter(model)
+
+
+def render(model, result: Any) -> Tuple[bytes, str]:
+    """JSON ответа и ETag по содержимому; одинаковы для живого запроса и сохраненного документа"""
+    model_adapter = adapter(model)
+    body = model_adapter.dump_json(model_adapter.validate_python(result, from_attributes=True))
+    return body, f'"{hashlib.sha1(body).hexdigest()[:16]}"'
+
+
+async def get_document(db: AsyncSession, kind: str, object_id: int) -> Optional[Tuple[bytes, str]]:
+    """Сохраненный документ; None, если его нет (в том числе в базе без таблицы документов)"""
+    try:
+        row = (await db.execute(
+            select(models.CFDetailDocument.body, models.CFDetailDocument.etag)
+            .where(models.CFDetailDocument.kind == kind, models.CFDetailDocument.object_id == object_id)
+        )).first()
+    except OperationalError:
+        await db.rollback()
+        return None
+    return tuple(row) if row is not None else None
+
+
+async def _store(session: AsyncSession, kind: str, model, objects):
+    rows = []
+    for obj in objects:
+        body, etag = render(model, obj)
+        rows.append({'kind': kind, 'object_id': obj.id, 'body': body, 'etag': etag})
+    if rows:
+        stmt = sqlite_insert(models.CFDetailDocument.__table__)
+        await session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=['kind', 'object_id'],
+                set_={'body': stmt.excluded.body, 'etag': stmt.excluded.etag, 'updated_at': stmt.excluded.updated_at}
+            ),
+            rows
+        )
+
+
+async def materialize_documents(
+        session: AsyncSession,
+        contest_ids: Iterable[int] = (),
+        problem_ids: Iterable[int] = ()
+):
+    """Пересборка документов для измененных контестов и задач.
+
+    Контест встраивает свои задачи, а задача — свои контесты, поэтому
+    вместе с ними пересобираются соседи через cf_problem_contest_association.
+    """
+    association = models.cf_problem_contest_association.c
+    contest_ids: Set[int] = set(contest_ids)
+    problem_ids: Set[int] = set(problem_ids)
+    if problem_ids:
+        contest_ids |= set((await session.execute(
+            select(association.contest_id).where(association.problem_id.in_(problem_ids))
+        )).scalars())
+    if contest_ids:
+        problem_ids |= set((await session.execute(
+            select(association.problem_id).where(association.contest_id.in_(contest_ids))
+        )).scalars())
+
+    await _render_batches(session, sorted(contest_ids), sorted(problem_ids))
+
+
+async def _render_batches(session: AsyncSession, contest_ids: List[int], problem_ids: List[int]):
+    for start in range(0, len(contest_ids), DOCUMENT_BATCH_SIZE):
+        contests = (await session.execute(
+            select(models.CFContest)
+            .where(models.CFContest.id.in_(contest_ids[start:start + DOCUMENT_BATCH_SIZE]))
+            .options(selectinload(models.CFContest.problems))
+            .execution_options(populate_existing=True)
+        )).scalars().all()
+        await _store(session, CONTEST, schemas.CFContestWithProblems, contests)
+
+    for start in range(0, len(problem_ids), DOCUMENT_BATCH_SIZE):
+        problems = (await session.execute(
+            select(models.CFProblem)
+            .where(models.CFProblem.id.in_(problem_ids[start:start + DOCUMENT_BATCH_SIZE]))
+            .options(
+                selectinload(models.CFProblem.contests),
+                selectinload(models.CFProblem.tags),
+                selectinload(models.CFProblem.statistics)
+            )
+            .execution_options(populate_existing=True)
+        )).scalars().all()
+        await _store(session, PROBLEM, schemas.CFProblemWithDetails, problems)
+
+
+async def materialize_all_documents(session: AsyncSession):
+    """Документы для всего каталога (после полной загрузки)"""
+    await _render_batches(
+        session,
+        (await session.execute(select(models.CFContest.id).order_by(models.CFContest.id))).scalars().all(),
+        (await session.execute(select(models.CFProblem.id).order_by(models.CFProblem.id))).scalars().all()
+    )
@@ -1,17 +1,28 @@
 import aiohttp
 import asyncio
+import heapq
 import ssl
+import time
+from contextlib import aclosing
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import select, insert, update, and_
+from sqlalchemy import select, insert, update, bindparam
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.sql import func
 from datetime import datetime
+from typing import List
 from models import (
-    Base, CFContest, CFProblem, CFTag, Language,
+    CFContest, CFProblem, CFTag, Language,
     CFProblemStatistics, cf_problem_tag_association,
     cf_problem_language_association, cf_problem_contest_association
 )
+from parser import STREAM_CHUNK_SIZE, iter_json_arrays
+from timeseries import record_solved_counts, apply_retention
+from documents import materialize_documents
+from init_db import create_schema
+from snapshot import write_snapshot
+from bitmaps import rebuild_solved_bitmaps
 import logging
-import os
 
 # Настройка логгирования
 logging.basicConfig(level=logging.INFO)
@@ -22,6 +33,20 @@ API_BASE_URL = "https://codeforces.com/api/"
 DEFAULT_LANGUAGES = ['ru', 'en']
 MAX_CONTESTS = 10
 TEST_DB_PATH = "test_youit.db"
+# Codeforces допускает не больше одного запроса к API за 2 секунды
+API_CALL_INTERVAL = 2.0
+# Повторы временных ошибок API (лимит запросов, 5xx, обрыв соединения): пауза удваивается
+API_MAX_RETRIES = 3
+API_RETRY_BACKOFF = 2.0
+# Верхняя граница числа строк таблицы в одном запросе contest.standings
+STANDINGS_MAX_ROWS = 100000
+
+# Параметры конвейера загрузки
+FETCH_WORKERS = 4
+QUEUE_SIZE = 100
+WRITE_BATCH_SIZE = 100
+STATS_LOG_INTERVAL = 5.0
+PROBLEM_COLUMNS = set(CFProblem.__table__.columns.keys())
 
 # SSL контекст
 ssl_context = ssl.create_default_context()
@@ -30,10 +55,10 @@ ssl_context.verify_mode = ssl.CERT_NONE
 
 
 async def create_test_db():
-    """Создание тестовой базы данных"""
+    """Создание тестовой базы данных или недостающих в ней таблиц"""
     test_engine = create_async_engine(f"sqlite+aiosqlite:///{TEST_DB_PATH}", echo=True)
     async with test_engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(create_schema)
 
         async with sessionmaker(test_engine, expire_on_commit=False, class_=AsyncSession)() as session:
             for lang_code in DEFAULT_LANGUAGES:
@@ -45,78 +70,193 @@ async def create_test_db():
     return test_engine
 
 
-async def fetch_data(session, url, params=None):
-    """Получение данных с API Codeforces"""
-    try:
-        async with session.get(url, params=params, ssl=ssl_context) as response:
-            if response.status == 200:
-                data = await response.json()
-                if data['status'] == 'OK':
-                    return data['result']
-                logger.error(f"API error: {data.get('comment', 'Unknown error')}")
-            else:
-                logger.error(f"HTTP error: {response.status}")
-    except Exception as e:
-        logger.error(f"Error fetching data from {url}: {str(e)}")
-    return None
+class RateLimiter:
+    """Не больше одного запроса за interval секунд на все корутины процесса.
 
+    Каждый вызов бронирует следующий свободный слот и спит до него, поэтому
+    одновременные запросы выстраиваются в очередь, а не уходят пачкой.
+    После share() слот хранится в разделяемой памяти и общий для всех процессов.
+    """
 
-async def get_or_create_tag(session, tag_name):
-    """Получение или создание тега"""
-    result = await session.execute(select(CFTag).where(CFTag.name == tag_name))
-    tag = result.scalars().first()
+    def __init__(self, interval):
+        self.interval = interval
+        self._next_slot = 0.0
+        self._shared = None
 
-    if not tag:
-        tag = CFTag(name=tag_name)
-        session.add(tag)
-        await session.commit()
-        await session.refresh(tag)
+    def share(self, next_slot):
+        """next_slot — multiprocessing.Value('d'), переданный всем рабочим процессам"""
+        self._shared = next_slot
 
-    return tag
+    def _reserve(self):
+        if self._shared is None:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+            return slot - now
+        with self._shared.get_lock():
+            now = time.time()
+            slot = max(now, self._shared.value)
+            self._shared.value = slot + self.interval
+        return slot - now
 
+    async def wait(self):
+        delay = self._reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+# Общий для всех стадий загрузки, трекера и загрузки хэндлов
+api_limiter = RateLimiter(API_CALL_INTERVAL)
+
+
+def share_api_limiter(next_slot):
+    """Инициализатор рабочих процессов backfill: один лимит запросов на все процессы"""
+    api_limiter.share(next_slot)
 
-async def get_problem_solved_count(http_session, contest_id, problem_index):
-    """Получение количества решений задачи с несколькими попытками"""
-    urls_to_try = [
-        (f"{API_BASE_URL}problemset.problems", None),
-        (f"{API_BASE_URL}contest.standings", {'contestId': contest_id, 'from': 1, 'count': 1}),
-        (f"{API_BASE_URL}contest.status", {'contestId': contest_id, 'from': 1, 'count': 1000})
-    ]
 
-    for url, params in urls_to_try:
+def is_retryable(status, comment=''):
+    """Временная ошибка: превышен лимит запросов или сбой на стороне Codeforces"""
+    return status == 429 or status >= 500 or 'limit exceeded' in (comment or '').lower()
+
+
+async def retry_pause(attempt):
+    if attempt:
+        await asyncio.sleep(API_RETRY_BACKOFF * 2 ** (attempt - 1))
+    await api_limiter.wait()
+
+
+async def fetch_data(session, url, params=None):
+    """Получение данных с API Codeforces; временные ошибки повторяются с нарастающей паузой"""
+    for attempt in range(API_MAX_RETRIES + 1):
+        await retry_pause(attempt)
         try:
-            data = await fetch_data(http_session, url, params)
-            if not data:
-                continue
+            async with session.get(url, params=params, ssl=ssl_context) as response:
+                if response.status == 200:
+                    data = await response.json()
+                    if data['status'] == 'OK':
+                        return data['result']
+                    comment = data.get('comment', 'Unknown error')
+                    logger.error(f"API error: {comment}")
+                    if not is_retryable(response.status, comment):
+                        return None
+                else:
+                    logger.error(f"HTTP error: {response.status}")
+                    if not is_retryable(response.status):
+                        return None
+        except Exception as e:
+            logger.error(f"Error fetching data from {url}: {str(e)}")
+    return None
+
 
-            if 'problemStatistics' in data:
-                for stat in data['problemStatistics']:
-                    if stat.get('contestId') == contest_id and stat.get('index') == problem_index:
-                        return stat.get('solvedCount', 0)
-
-            if 'problems' in data:
-                for problem in data['problems']:
-                    if problem.get('index') == problem_index and 'solvedCount' in problem:
-                        return problem['solvedCount']
-
-            if 'rows' in data:
-                for row in data['rows']:
-                    for problem_result in row['problemResults']:
-                        if problem_result.get('index') == problem_index and 'solvedCount' in problem_result:
-                            return problem_result['solvedCount']
-
-            if isinstance(data, list):
-                solved_count = len([sub for sub in data
-                                    if sub.get('verdict') == 'OK'
-                                    and sub.get('problem', {}).get('index') == problem_index])
-                if solved_count > 0:
-                    return solved_count
+class CodeforcesAPIError(Exception):
+    """Ответ API Codeforces не удалось прочитать целиком"""
 
+
+async def stream_data(session, url, targets, params=None):
+    """Потоковое получение элементов больших массивов из ответа API Codeforces.
+
+    targets сопоставляет путь внутри result с меткой, которая отдается вместе
+    с каждым элементом: {('problems',): 'problems'} или {(): 'submissions'}.
+    Ошибка HTTP или API и обрыв соединения посреди ответа поднимают CodeforcesAPIError:
+    обрезанный список нельзя принимать за полный. Временные ошибки повторяются,
+    пока не отдан первый элемент.
+    """
+    paths = {('result',) + path: kind for path, kind in targets.items()}
+    for attempt in range(API_MAX_RETRIES + 1):
+        await retry_pause(attempt)
+        captured = {}
+        started = False
+        try:
+            async with session.get(url, params=params, ssl=ssl_context) as response:
+                if response.status != 200:
+                    error = CodeforcesAPIError(f"HTTP error {response.status} from {url}")
+                    retryable = is_retryable(response.status)
+                else:
+                    chunks = response.content.iter_chunked(STREAM_CHUNK_SIZE)
+                    async for path, item in iter_json_arrays(chunks, paths, captured):
+                        started = True
+                        yield paths[path], item
+                    # Без status ответ не дочитан до конца (например, пустое тело)
+                    if captured.get(('status',)) == 'OK':
+                        return
+                    comment = captured.get(('comment',), 'Unknown error')
+                    error = CodeforcesAPIError(f"API error: {comment}")
+                    retryable = is_retryable(response.status, comment)
         except Exception as e:
-            logger.warning(f"Failed to get solved count from {url}: {str(e)}")
-            continue
+            error = CodeforcesAPIError(f"Error streaming data from {url}: {str(e)}")
+            retryable = True
+        if started or not retryable:
+            raise error
+        logger.warning(f"{error}, retrying")
+    raise error
+
+
+def stream_problemset(http_session):
+    """Поток задач ('problems') и их статистики ('statistics') из problemset.problems"""
+    return stream_data(
+        http_session,
+        f"{API_BASE_URL}problemset.problems",
+        {('problems',): 'problems', ('problemStatistics',): 'statistics'}
+    )
 
-    return 0
+
+def stream_contest_standings(http_session, contest_id, start=1, count=1, **params):
+    """Поток задач ('problems') и строк таблицы ('rows') из contest.standings"""
+    return stream_data(
+        http_session,
+        f"{API_BASE_URL}contest.standings",
+        {('problems',): 'problems', ('rows',): 'rows'},
+        {'contestId': contest_id, 'from': start, 'count': count, **params}
+    )
+
+
+async def get_user_submissions(http_session, handle, start=1, count=1000):
+    """Страница посылок пользователя из user.status (новые первыми) или None при ошибке"""
+    return await fetch_data(
+        http_session,
+        f"{API_BASE_URL}user.status",
+        {'handle': handle, 'from': start, 'count': count}
+    )
+
+
+async def get_contest_solved_counts(http_session, contest_id, count=STANDINGS_MAX_ROWS):
+    """Задачи контеста и число решивших каждую по таблице: (problems, {index: solved_count}).
+
+    Для задач, которых нет в статистике problemset.problems (gym, свежие контесты):
+    у Problem и ProblemResult нет solvedCount, поэтому считаются строки таблицы
+    с points > 0 по каждой колонке. None, если таблица не загрузилась целиком.
+    """
+    problems: List[dict] = []
+    solved: List[int] = []
+    try:
+        async with aclosing(stream_contest_standings(http_session, contest_id, count=count)) as stream:
+            async for kind, item in stream:
+                if kind == 'problems':
+                    problems.append(item)
+                elif kind == 'rows':
+                    # problemResults идут в том же порядке, что и problems
+                    results = item.get('problemResults', [])
+                    if len(solved) < len(results):
+                        solved.extend([0] * (len(results) - len(solved)))
+                    for position, result in enumerate(results):
+                        if result.get('points', 0) > 0:
+                            solved[position] += 1
+    except CodeforcesAPIError as e:
+        logger.warning(str(e))
+        return None
+    if not problems:
+        return None
+    solved.extend([0] * (len(problems) - len(solved)))
+    return problems, {problem['index']: solved_count for problem, solved_count in zip(problems, solved)}
+
+
+async def load_problemset_statistics(http_session):
+    """Количество решений всех задач архива одним потоковым запросом: {(contestId, index): solvedCount}"""
+    statistics = {}
+    async for kind, item in stream_problemset(http_session):
+        if kind == 'statistics':
+            statistics[(item.get('contestId'), item.get('index'))] = item.get('solvedCount', 0)
+    return statistics
 
 
 def get_problem_url(contest_id, problem_index):
@@ -137,8 +277,8 @@ def get_contest_url(contest_id):
     return f"https://codeforces.com/gym/{contest_id}"
 
 
-async def get_problem_translation(http_session, contest_id, problem_index, lang):
-    """Получение перевода задачи"""
+async def get_contest_translations(http_session, contest_id, lang):
+    """Получение переводов всех задач контеста: {index: задача}"""
     url = f"{API_BASE_URL}contest.standings"
     params = {
         'contestId': contest_id,
@@ -150,47 +290,86 @@ async def get_problem_translation(http_session, contest_id, problem_index, lang)
 
     data = await fetch_data(http_session, url, params)
     if data and 'problems' in data:
-        for problem in data['problems']:
-            if problem.get('index') == problem_index:
-                return problem
-    return None
+        return {problem.get('index'): problem for problem in data['problems']}
+    return {}
 
 
-async def add_problem_language(session, problem_id, lang_code):
-    """Добавление связи задачи с языком"""
-    result = await session.execute(
-        select(cf_problem_language_association).where(
-            (cf_problem_language_association.c.problem_id == problem_id) &
-            (cf_problem_language_association.c.language_code == lang_code)
-        )
-    )
-    if not result.first():
-        await session.execute(
-            insert(cf_problem_language_association).values(
-                problem_id=problem_id,
-                language_code=lang_code
-            )
-        )
+async def get_contest_problems(http_session, contest_id):
+    """Получение списка задач для контеста"""
+    url = f"{API_BASE_URL}contest.standings"
+    params = {
+        'contestId': contest_id,
+        'showUnofficial': 'false',
+        'from': 1,
+        'count': 1
+    }
 
+    data = await fetch_data(http_session, url, params)
+    return data['problems'] if data and 'problems' in data else None
 
-async def process_problem(session, http_session, contest_id, problem_data):
-    """Обработка и сохранение информации о задаче"""
-    problem_uid = f"{contest_id}_{problem_data['index']}"
 
-    # Проверяем существование задачи
-    result = await session.execute(
-        select(CFProblem).where(CFProblem.problem_uid == problem_uid)
-    )
-    problem = result.scalars().first()
+async def get_finished_contests(http_session, gym=False):
+    """Получение всех завершенных контестов (или тренировок gym)"""
+    url = f"{API_BASE_URL}contest.list"
+    params = {'gym': 'true'} if gym else None
+    return [
+        contest async for _, contest in stream_data(http_session, url, {(): 'contests'}, params)
+        if contest['phase'] == 'FINISHED'
+    ]
+
 
-    # Получаем переводы
-    ru_data = await get_problem_translation(http_session, contest_id, problem_data['index'], 'ru')
-    en_data = await get_problem_translation(http_session, contest_id, problem_data['index'], 'en')
+async def get_all_contests(http_session):
+    """Все контесты в любой фазе или None, если список не удалось прочитать целиком"""
+    url = f"{API_BASE_URL}contest.list"
+    try:
+        return [contest async for _, contest in stream_data(http_session, url, {(): 'contests'})]
+    except CodeforcesAPIError as e:
+        logger.error(str(e))
+        return None
+
+
+async def get_contest_list(http_session):
+    """Получение списка контестов"""
+    url = f"{API_BASE_URL}contest.list"
+
+    # Держим в памяти только MAX_CONTESTS самых свежих завершенных контестов
+    latest = []
+    async for _, contest in stream_data(http_session, url, {(): 'contests'}):
+        if contest['phase'] != 'FINISHED':
+            continue
+        entry = (contest['startTimeSeconds'], contest['id'], contest)
+        if len(latest) < MAX_CONTESTS:
+            heapq.heappush(latest, entry)
+        else:
+            heapq.heappushpop(latest, entry)
+
+    if latest:
+        return [contest for _, _, contest in sorted(latest, reverse=True)]
+    return None
+
+
+# --- Стадия преобразования ---
+def build_contest_dict(contest_data):
+    """Подготовка строки контеста из ответа API"""
+    return {
+        'cf_contest_id': contest_data['id'],
+        'name': contest_data.get('name', ''),
+        'type': contest_data.get('type', ''),
+        'phase': contest_data.get('phase', ''),
+        'start_time': datetime.fromtimestamp(contest_data['startTimeSeconds'])
+        if 'startTimeSeconds' in contest_data else None,
+        'duration': contest_data['durationSeconds'] // 60
+        if 'durationSeconds' in contest_data else None,
+        'contest_url': get_contest_url(contest_data['id'])
+    }
+
+
+def build_problem_record(contest_id, problem_data, ru_data, en_data, solved_count):
+    """Подготовка задачи, ее тегов, языков и статистики из ответа API"""
     localized_data = ru_data if ru_data else en_data if en_data else problem_data
 
-    # Подготовка данных задачи
     problem_dict = {
-        'problem_uid': problem_uid,
+        'problem_uid': f"{contest_id}_{problem_data['index']}",
         'cf_problem_index': problem_data['index'],
         'name': localized_data.get('name', problem_data.get('name', '')),
         'rating': problem_data.get('rating'),
@@ -199,147 +378,325 @@ async def process_problem(session, http_session, contest_id, problem_data):
         'problem_url': get_problem_url(contest_id, problem_data['index'])
     }
 
-    if problem:
-        await session.execute(
-            update(CFProblem).where(CFProblem.id == problem.id).values(**problem_dict)
-        )
-    else:
-        problem = CFProblem(**problem_dict)
-        session.add(problem)
+    languages = []
+    if ru_data:
+        languages.append('ru')
+    if en_data or not ru_data:
+        languages.append('en')
+
+    return {
+        'cf_contest_id': contest_id,
+        # В таблице хранятся только существующие колонки (лимиты пока не сохраняются)
+        'problem': {key: value for key, value in problem_dict.items() if key in PROBLEM_COLUMNS},
+        'tags': problem_data.get('tags', []),
+        'languages': languages,
+        'solved_count': solved_count
+    }
 
-    await session.flush()
 
-    # Получаем или создаем контест
-    contest_result = await session.execute(
-        select(CFContest).where(CFContest.cf_contest_id == contest_id)
+# --- Стадия записи ---
+def upsert(table, index_elements, rows):
+    """INSERT ... ON CONFLICT DO UPDATE для пачки строк одной таблицы"""
+    stmt = sqlite_insert(table)
+    update_columns = [key for key in rows[0] if key not in index_elements]
+    return stmt.on_conflict_do_update(
+        index_elements=index_elements,
+        set_={key: stmt.excluded[key] for key in update_columns}
     )
-    contest = contest_result.scalars().first()
 
-    if contest:
-        # Добавляем статистику
-        solved_count = await get_problem_solved_count(http_session, contest_id, problem_data['index'])
 
-        stat_result = await session.execute(
-            select(CFProblemStatistics).where(
-                CFProblemStatistics.problem_id == problem.id,
-                CFProblemStatistics.contest_id == contest.id
-            )
+async def write_batch(session, batch, materialize=True, history=True):
+    """Запись пачки контестов и задач несколькими множественными запросами.
+
+    materialize=False пропускает сборку детальных документов, history=False — замеры
+    solved_count: в промежуточных базах backfill свои id, и то и другое пишется после слияния.
+    """
+    contests = [record for kind, record in batch if kind == 'contest']
+    problems = [record for kind, record in batch if kind == 'problem']
+
+    written_contests = []
+    if contests:
+        await session.execute(upsert(CFContest.__table__, ['cf_contest_id'], contests), contests)
+        written_contests = (await session.execute(
+            select(CFContest.id).where(CFContest.cf_contest_id.in_([row['cf_contest_id'] for row in contests]))
+        )).scalars().all()
+    if not problems:
+        if materialize:
+            await materialize_documents(session, contest_ids=written_contests)
+        return
+
+    problem_rows = [record['problem'] for record in problems]
+    await session.execute(upsert(CFProblem.__table__, ['problem_uid'], problem_rows), problem_rows)
+
+    problem_ids = dict((await session.execute(
+        select(CFProblem.problem_uid, CFProblem.id)
+        .where(CFProblem.problem_uid.in_([row['problem_uid'] for row in problem_rows]))
+    )).all())
+    contest_ids = dict((await session.execute(
+        select(CFContest.cf_contest_id, CFContest.id)
+        .where(CFContest.cf_contest_id.in_({record['cf_contest_id'] for record in problems}))
+    )).all())
+
+    tag_names = sorted({tag for record in problems for tag in record['tags']})
+    tag_ids = {}
+    if tag_names:
+        await session.execute(
+            sqlite_insert(CFTag.__table__).on_conflict_do_nothing(index_elements=['name']),
+            [{'name': name} for name in tag_names]
         )
-        stat = stat_result.scalars().first()
-
-        if stat:
-            stat.solved_count = solved_count
-        else:
-            stat = CFProblemStatistics(
-                problem_id=problem.id,
-                contest_id=contest.id,
-                solved_count=solved_count
-            )
-            session.add(stat)
-
-        # Добавляем связь с контестом если ее нет
-        assoc_result = await session.execute(
-            select(cf_problem_contest_association).where(
-                cf_problem_contest_association.c.problem_id == problem.id,
-                cf_problem_contest_association.c.contest_id == contest.id
-            )
+        tag_ids = dict((await session.execute(
+            select(CFTag.name, CFTag.id).where(CFTag.name.in_(tag_names))
+        )).all())
+
+    tag_links, language_links, contest_links, stat_rows = [], [], [], []
+    for record in problems:
+        problem_id = problem_ids[record['problem']['problem_uid']]
+        tag_links.extend({'problem_id': problem_id, 'tag_id': tag_ids[tag]} for tag in record['tags'])
+        language_links.extend(
+            {'problem_id': problem_id, 'language_code': code} for code in record['languages']
         )
-        if not assoc_result.first():
+        contest_id = contest_ids.get(record['cf_contest_id'])
+        if contest_id is not None:
+            contest_links.append({'problem_id': problem_id, 'contest_id': contest_id})
+            stat_rows.append({
+                'problem_id': problem_id,
+                'contest_id': contest_id,
+                'solved_count': record['solved_count']
+            })
+
+    for table, rows in (
+            (cf_problem_tag_association, tag_links),
+            (cf_problem_language_association, language_links),
+            (cf_problem_contest_association, contest_links)
+    ):
+        if rows:
+            await session.execute(sqlite_insert(table).on_conflict_do_nothing(), rows)
+
+    if stat_rows:
+        # У статистики нет уникального ключа, поэтому разделяем на обновления и вставки
+        existing = {
+            (problem_id, contest_id): stat_id
+            for stat_id, problem_id, contest_id in (await session.execute(
+                select(
+                    CFProblemStatistics.id,
+                    CFProblemStatistics.problem_id,
+                    CFProblemStatistics.contest_id
+                ).where(CFProblemStatistics.problem_id.in_([row['problem_id'] for row in stat_rows]))
+            )).all()
+        }
+        updates = [
+            {'stat_id': existing[(row['problem_id'], row['contest_id'])], 'solved_count': row['solved_count']}
+            for row in stat_rows if (row['problem_id'], row['contest_id']) in existing
+        ]
+        inserts = [row for row in stat_rows if (row['problem_id'], row['contest_id']) not in existing]
+        if updates:
             await session.execute(
-                insert(cf_problem_contest_association).values(
-                    problem_id=problem.id,
-                    contest_id=contest.id
-                )
+                update(CFProblemStatistics.__table__)
+                .where(CFProblemStatistics.__table__.c.id == bindparam('stat_id'))
+                .values(solved_count=bindparam('solved_count'), last_updated=func.now()),
+                updates
             )
+        if inserts:
+            await session.execute(insert(CFProblemStatistics.__table__), inserts)
 
-    # Обработка тегов
-    if 'tags' in problem_data:
-        for tag_name in problem_data['tags']:
-            tag = await get_or_create_tag(session, tag_name)
-            result = await session.execute(
-                select(cf_problem_tag_association).where(
-                    (cf_problem_tag_association.c.problem_id == problem.id) &
-                    (cf_problem_tag_association.c.tag_id == tag.id)
-                )
+        if history:
+            await record_solved_counts(
+                session, [(row['problem_id'], row['contest_id'], row['solved_count']) for row in stat_rows]
             )
-            if not result.first():
-                await session.execute(
-                    insert(cf_problem_tag_association).values(
-                        problem_id=problem.id,
-                        tag_id=tag.id
-                    )
-                )
-
-    # Обработка языков
-    if ru_data:
-        await add_problem_language(session, problem.id, 'ru')
-    if en_data or not ru_data:
-        await add_problem_language(session, problem.id, 'en')
-
-    return problem
-
-
-async def process_contest(session, contest_data):
-    """Обработка и сохранение информации о контесте"""
-    result = await session.execute(
-        select(CFContest).where(CFContest.cf_contest_id == contest_data['id'])
-    )
-    contest = result.scalars().first()
 
-    contest_dict = {
-        'cf_contest_id': contest_data['id'],
-        'name': contest_data.get('name', ''),
-        'type': contest_data.get('type', ''),
-        'phase': contest_data.get('phase', ''),
-        'start_time': datetime.fromtimestamp(contest_data['startTimeSeconds'])
-        if 'startTimeSeconds' in contest_data else None,
-        'duration': contest_data['durationSeconds'] // 60
-        if 'durationSeconds' in contest_data else None,
-        'contest_url': get_contest_url(contest_data['id'])
-    }
-
-    if contest:
-        await session.execute(
-            update(CFContest).where(CFContest.id == contest.id).values(**contest_dict)
+    # Детальные ответы пересобираются в той же транзакции, что и данные
+    if materialize:
+        await materialize_documents(
+            session,
+            contest_ids=[*written_contests, *contest_ids.values()],
+            problem_ids=problem_ids.values()
         )
-    else:
-        contest = CFContest(**contest_dict)
-        session.add(contest)
 
-    await session.flush()
-    return contest
 
+# --- Конвейер ---
+class StageStats:
+    """Пропускная способность стадии: обработанные элементы, простой и ожидание из-за backpressure"""
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.idle = 0.0
+        self.blocked = 0.0
+        self.started = time.monotonic()
+
+    async def get(self, queue):
+        started = time.monotonic()
+        item = await queue.get()
+        self.idle += time.monotonic() - started
+        return item
+
+    async def put(self, queue, item):
+        started = time.monotonic()
+        await queue.put(item)
+        self.blocked += time.monotonic() - started
+
+    def report(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return (f"{self.name}: {self.items} items, {self.items / elapsed:.1f}/s, "
+                f"idle {self.idle:.1f}s, blocked {self.blocked:.1f}s")
+
+
+async def fetch_stage(http_session, contest_queue, raw_queue, statistics, stats, failed):
+    """Стадия загрузки: контесты, их задачи, переводы и количество решений.
+
+    id контестов, которые не удалось загрузить, добавляются в failed.
+    """
+    while True:
+        contest_data = await stats.get(contest_queue)
+        if contest_data is None:
+            return
+        contest_id = contest_data['id']
+        try:
+            await stats.put(raw_queue, ('contest', contest_data))
 
-async def get_contest_problems(http_session, contest_id):
-    """Получение списка задач для контеста"""
-    url = f"{API_BASE_URL}contest.standings"
-    params = {
-        'contestId': contest_id,
-        'showUnofficial': 'false',
-        'from': 1,
-        'count': 1
-    }
+            problems = await get_contest_problems(http_session, contest_id)
+            if problems is None:
+                raise CodeforcesAPIError("failed to fetch problems")
+            if not problems:
+                logger.warning(f"No problems found for contest {contest_id}")
+                continue
 
-    data = await fetch_data(http_session, url, params)
-    return data['problems'] if data and 'problems' in data else None
+            ru_problems, en_problems = await asyncio.gather(
+                get_contest_translations(http_session, contest_id, 'ru'),
+                get_contest_translations(http_session, contest_id, 'en')
+            )
+            # Задач нет в статистике архива: одна таблица на весь контест, а не запрос на задачу
+            fallback = {}
+            if any((contest_id, problem_data['index']) not in statistics for problem_data in problems):
+                counted = await get_contest_solved_counts(http_session, contest_id)
+                if counted is None:
+                    logger.warning(f"Failed to count solutions of contest {contest_id}, using 0")
+                else:
+                    fallback = counted[1]
+
+            for problem_data in problems:
+                index = problem_data['index']
+                solved_count = statistics.get((contest_id, index))
+                if solved_count is None:
+                    solved_count = fallback.get(index, 0)
+                await stats.put(raw_queue, (
+                    'problem', contest_id, problem_data,
+                    ru_problems.get(index), en_problems.get(index), solved_count
+                ))
+                stats.items += 1
+        except Exception as e:
+            failed.append(contest_id)
+            logger.error(f"Error fetching contest {contest_id}: {str(e)}")
 
 
-async def get_contest_list(http_session):
-    """Получение списка контестов"""
-    url = f"{API_BASE_URL}contest.list"
-    data = await fetch_data(http_session, url)
+async def transform_stage(raw_queue, write_queue, stats):
+    """Стадия преобразования ответов API в строки таблиц"""
+    while True:
+        item = await stats.get(raw_queue)
+        if item is None:
+            await stats.put(write_queue, None)
+            return
+        try:
+            if item[0] == 'contest':
+                record = ('contest', build_contest_dict(item[1]))
+            else:
+                record = ('problem', build_problem_record(*item[1:]))
+        except Exception as e:
+            logger.error(f"Error transforming {item[0]}: {str(e)}")
+            continue
+        await stats.put(write_queue, record)
+        stats.items += 1
+
+
+async def write_stage(db_session, write_queue, stats, failed, materialize=True, history=True):
+    """Единственный писатель: собирает пачки из очереди и пишет их одной транзакцией.
+
+    Контесты пачки, которую не удалось записать, добавляются в failed.
+    """
+    finished = False
+    while not finished:
+        batch = []
+        item = await stats.get(write_queue)
+        while item is not None:
+            batch.append(item)
+            if len(batch) >= WRITE_BATCH_SIZE or write_queue.empty():
+                break
+            item = write_queue.get_nowait()
+        finished = item is None
+        if not batch:
+            continue
 
-    if data:
-        finished_contests = [c for c in data if c['phase'] == 'FINISHED']
-        finished_contests.sort(key=lambda x: x['startTimeSeconds'], reverse=True)
-        return finished_contests[:MAX_CONTESTS]
-    return None
+        async with db_session() as session:
+            try:
+                await write_batch(session, batch, materialize, history)
+                await session.commit()
+                stats.items += len(batch)
+            except Exception as e:
+                await session.rollback()
+                contests = sorted({record[1]['cf_contest_id'] for record in batch})
+                failed.extend(contest_id for contest_id in contests if contest_id not in failed)
+                logger.error(f"Error writing batch of {len(batch)} records (contests {contests}): {str(e)}")
+
+
+async def report_stages(stages):
+    while True:
+        await asyncio.sleep(STATS_LOG_INTERVAL)
+        for stage in stages:
+            logger.info(f"[pipeline] {stage.report()}")
+
+
+async def run_pipeline(
+        http_session, db_session, contests, statistics, fetch_workers=FETCH_WORKERS, materialize=True, history=True
+):
+    """Загрузка -> преобразование -> запись, связанные ограниченными очередями.
+
+    Возвращает id контестов, которые не удалось загрузить.
+    """
+    failed = []
+    contest_queue = asyncio.Queue()
+    raw_queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+    write_queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+
+    fetch_stats = StageStats('fetch')
+    transform_stats = StageStats('transform')
+    write_stats = StageStats('write')
+
+    for contest_data in contests:
+        contest_queue.put_nowait(contest_data)
+    for _ in range(fetch_workers):
+        contest_queue.put_nowait(None)
+
+    async def fetch_all():
+        await asyncio.gather(*(
+            fetch_stage(http_session, contest_queue, raw_queue, statistics, fetch_stats, failed)
+            for _ in range(fetch_workers)
+        ))
+        await raw_queue.put(None)
+
+    reporter = asyncio.create_task(report_stages([fetch_stats, transform_stats, write_stats]))
+    # Все стадии ожидаются вместе: если упадет писатель, загрузчики не повиснут на полной очереди
+    stages = [
+        asyncio.create_task(fetch_all()),
+        asyncio.create_task(transform_stage(raw_queue, write_queue, transform_stats)),
+        asyncio.create_task(write_stage(db_session, write_queue, write_stats, failed, materialize, history)),
+    ]
+    try:
+        await asyncio.gather(*stages)
+    finally:
+        reporter.cancel()
+        for stage in stages:
+            stage.cancel()
 
+    for stage in (fetch_stats, transform_stats, write_stats):
+        logger.info(f"[pipeline] {stage.report()}")
+    if failed:
+        logger.error(f"[pipeline] {len(failed)} contests failed: {sorted(failed)}")
+    return failed
 
-async def main():
-    if os.path.exists(TEST_DB_PATH):
-        os.remove(TEST_DB_PATH)
 
+async def main():
+    # База не пересоздается: загрузка идемпотентна, а история solved_count,
+    # отслеживаемые хэндлы и импорт в YouIT должны переживать синхронизации
     test_engine = await create_test_db()
     test_session = sessionmaker(test_engine, expire_on_commit=False, class_=AsyncSession)
 
@@ -351,34 +708,20 @@ async def main():
                 logger.error("No contests found")
                 return
 
+            statistics = await load_problemset_statistics(http_session)
+            failed = await run_pipeline(http_session, test_session, contests, statistics)
+
             async with test_session() as session:
-                for contest_data in contests:
-                    try:
-                        contest = await process_contest(session, contest_data)
-                        await session.commit()
-
-                        logger.info(f"Processing contest: {contest.name} (ID: {contest.cf_contest_id})")
-
-                        problems = await get_contest_problems(http_session, contest.cf_contest_id)
-                        if not problems:
-                            logger.warning(f"No problems found for contest {contest.cf_contest_id}")
-                            continue
-
-                        for problem_data in problems:
-                            try:
-                                problem = await process_problem(session, http_session,
-                                                                contest.cf_contest_id, problem_data)
-                                await session.commit()
-                                logger.info(f"  - Processed problem: {problem.name}")
-                            except Exception as e:
-                                await session.rollback()
-                                logger.error(f"Error processing problem {problem_data.get('index')}: {str(e)}")
-
-                    except Exception as e:
-                        await session.rollback()
-                        logger.error(f"Error processing contest {contest_data.get('id')}: {str(e)}")
-
-                logger.info(f"Parsing completed. Database created at {TEST_DB_PATH}")
+                await apply_retention(session)
+                await rebuild_solved_bitmaps(session)
+                await session.commit()
+                if failed:
+                    # Каталог неполный: воркеры читают его из базы, пока следующая синхронизация не пройдет целиком
+                    logger.error(f"Contests {sorted(failed)} were not loaded; catalog snapshot is not written")
+                    return
+                await write_snapshot(session)
+
+            logger.info(f"Parsing completed. Database updated at {TEST_DB_PATH}")
 
         except Exception as e:
             logger.error(f"Fatal error: {str(e)}")
@@ -387,4 +730,4 @@ async def main():
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
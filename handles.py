@@ -0,0 +1,120 @@
+import argparse
+import asyncio
+import logging
+from typing import List, Optional, Set, Tuple
+
+import aiohttp
+from sqlalchemy import select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from bitmaps import join_uids, rebuild_solved_bitmaps, split_uids
+from database import AsyncSessionLocal, engine
+from fill_db import ssl_context, get_user_submissions
+from models import CFTrackedHandle
+from init_db import create_schema
+
+logger = logging.getLogger(__name__)
+
+# Размер страницы user.status
+SUBMISSIONS_PAGE_SIZE = 1000
+# Пауза между хэндлами, чтобы не упираться в лимит API Codeforces
+HANDLE_SYNC_DELAY = 0.5
+
+
+async def fetch_new_accepted(
+        http_session, handle: str, last_submission_id: int
+) -> Optional[Tuple[Set[str], int]]:
+    """problem_uid задач, принятых после last_submission_id, и id самой новой посылки.
+
+    Посылки идут от новых к старым, поэтому страницы читаются до первой уже
+    обработанной. При ошибке возвращает None: курсор не должен сдвинуться,
+    иначе недочитанные посылки потеряются.
+    """
+    accepted = set()
+    newest = last_submission_id
+    start = 1
+    while True:
+        submissions = await get_user_submissions(http_session, handle, start, SUBMISSIONS_PAGE_SIZE)
+        if submissions is None:
+            return None
+
+        for submission in submissions:
+            if submission['id'] <= last_submission_id:
+                return accepted, newest
+            newest = max(newest, submission['id'])
+            problem = submission.get('problem', {})
+            if submission.get('verdict') == 'OK' and 'contestId' in problem:
+                accepted.add(f"{problem['contestId']}_{problem['index']}")
+
+        if len(submissions) < SUBMISSIONS_PAGE_SIZE:
+            return accepted, newest
+        start += SUBMISSIONS_PAGE_SIZE
+
+
+async def track_handles(session: AsyncSession, handles: List[str]):
+    if handles:
+        await session.execute(
+            sqlite_insert(CFTrackedHandle.__table__).on_conflict_do_nothing(index_elements=['handle']),
+            [
+                {'handle': handle, 'last_submission_id': 0, 'solved_uids': '', 'solved_bitmap': b'', 'solved_count': 0}
+                for handle in {handle.lower() for handle in handles}
+            ]
+        )
+
+
+async def sync_handle(http_session, session: AsyncSession, handle: str) -> bool:
+    """Дозагрузка посылок хэндла и обновление его битовой карты решенных задач"""
+    tracked = (await session.execute(
+        select(CFTrackedHandle).where(CFTrackedHandle.handle == handle)
+    )).scalar_one()
+
+    fetched = await fetch_new_accepted(http_session, handle, tracked.last_submission_id)
+    if fetched is None:
+        logger.error(f"Failed to fetch submissions of {handle}")
+        return False
+    accepted, newest = fetched
+
+    await session.execute(
+        update(CFTrackedHandle)
+        .where(CFTrackedHandle.id == tracked.id)
+        .values(last_submission_id=newest, solved_uids=join_uids(split_uids(tracked.solved_uids) | accepted))
+    )
+    # Карта собирается заново: задачи, которых не было в каталоге, сопоставятся сейчас
+    await rebuild_solved_bitmaps(session, [tracked.id])
+    solved_count = (await session.execute(
+        select(CFTrackedHandle.solved_count).where(CFTrackedHandle.id == tracked.id)
+    )).scalar_one()
+    logger.info(f"{handle}: {len(accepted)} new accepted problems, {solved_count} solved in catalog")
+    return True
+
+
+async def sync_handles(handles: Optional[List[str]] = None):
+    """Добавление хэндлов в отслеживаемые и дозагрузка всех отслеживаемых"""
+    async with engine.begin() as conn:
+        await conn.run_sync(create_schema)
+
+    async with AsyncSessionLocal() as session:
+        await track_handles(session, handles or [])
+        await session.commit()
+        tracked = (await session.execute(select(CFTrackedHandle.handle).order_by(CFTrackedHandle.handle))).scalars().all()
+
+    conn = aiohttp.TCPConnector(ssl=ssl_context)
+    async with aiohttp.ClientSession(connector=conn) as http_session:
+        for i, handle in enumerate(tracked):
+            if i:
+                await asyncio.sleep(HANDLE_SYNC_DELAY)
+            # Каждый хэндл в своей транзакции: ошибка одного не откатывает остальные
+            async with AsyncSessionLocal() as session:
+                if await sync_handle(http_session, session, handle):
+                    await session.commit()
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Загрузка решенных задач отслеживаемых хэндлов Codeforces")
+    arg_parser.add_argument("handles", nargs="*", help="Новые хэндлы для отслеживания")
+    args = arg_parser.parse_args()
+
+    logging.getLogger('sqlalchemy.engine').setLevel(logging.WARNING)
+    asyncio.run(sync_handles(args.handles))
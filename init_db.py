@@ -1,10 +1,31 @@
 import asyncio
+import uuid
+
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+import models  # noqa: F401 — регистрирует таблицы в Base.metadata
 from database import engine, Base
 
-async def create_tables():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-    print("Таблицы успешно созданы")
+
+def create_schema(conn):
+    """Создание недостающих таблиц и индексов; существующие данные не трогаются"""
+    Base.metadata.create_all(conn)
+    # create_all не добавляет новые индексы в уже существующие таблицы
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+    # Метка экземпляра базы: по ней воркеры узнают, что снимок каталога записан для другой базы
+    conn.execute(
+        sqlite_insert(models.DatabaseInfo.__table__)
+        .values(key='instance', value=uuid.uuid4().hex)
+        .on_conflict_do_nothing(index_elements=['key'])
+    )
+
+
+async def create_tables(db_engine=engine):
+    async with db_engine.begin() as conn:
+        await conn.run_sync(create_schema)
 
 if __name__ == "__main__":
-    asyncio.run(create_tables())
\ No newline at end of file
+    asyncio.run(create_tables())
+    print("Таблицы успешно созданы")
@@ -0,0 +1,417 @@
+import argparse
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Set
+
+import aiohttp
+from sqlalchemy import delete, select, update, bindparam
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.sql import func
+
+from fill_db import (
+    ssl_context, get_all_contests, get_contest_solved_counts,
+    build_contest_dict, build_problem_record, write_batch
+)
+from database import AsyncSessionLocal, DATABASE_PATH, engine
+from init_db import create_tables
+from models import CFContest, CFLiveContest, CFProblem, CFProblemStatistics
+from timeseries import record_solved_counts
+from documents import materialize_documents
+from snapshot import write_snapshot
+from bitmaps import rebuild_solved_bitmaps
+
+logger = logging.getLogger(__name__)
+
+# Как часто опрашивать таблицы идущих контестов и список контестов (секунды).
+# Таблица запрашивается целиком, поэтому опрос редкий; при ошибках интервал удваивается до LIVE_MAX_BACKOFF
+LIVE_POLL_INTERVAL = 60.0
+CONTEST_LIST_INTERVAL = 300.0
+LIVE_MAX_BACKOFF = 900.0
+# Пауза между запросами к API внутри одного цикла опроса
+LIVE_REQUEST_DELAY = 0.5
+# Очередь событий подписчика; переполненная очередь заменяется свежим снимком
+SUBSCRIBER_QUEUE_SIZE = 100
+# Интервал комментариев keep-alive в потоке SSE
+SSE_KEEPALIVE = 15.0
+# Как часто воркер перечитывает состояние идущих контестов из базы
+LIVE_FEED_INTERVAL = 2.0
+# Сколько хранить состояние закончившегося контеста, чтобы все воркеры успели разослать finished
+FINISHED_STATE_TTL = 600.0
+# Опрос Codeforces ведет один процесс: его выбирает блокировка этого файла
+LIVE_TRACKER_LOCK = os.path.join(os.path.dirname(DATABASE_PATH) or ".", "live_tracker.lock")
+
+
+class LiveContest:
+    __slots__ = ("data", "contest_id", "problem_ids", "solved", "updated")
+
+    def __init__(self, data: dict):
+        self.data = data
+        self.contest_id: Optional[int] = None  # cf_contests.id после первой записи
+        self.problem_ids: Dict[str, int] = {}
+        self.solved: Dict[str, int] = {}
+        self.updated: Optional[float] = None
+
+    def snapshot(self) -> dict:
+        return {
+            'type': 'snapshot',
+            'contest_id': self.contest_id,
+            'cf_contest_id': self.data['id'],
+            'name': self.data.get('name'),
+            'solved': self.solved,
+            'updated': self.updated,
+        }
+
+
+def acquire_tracker_lock(lock_file) -> bool:
+    try:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+
+class LiveContestTracker:
+    """Опрос таблиц идущих контестов: один запрос к API на контест на всю установку.
+
+    Работает в одном процессе (python live.py или единственный воркер с
+    RUN_LIVE_TRACKER): кто первым взял LIVE_TRACKER_LOCK, тот и опрашивает,
+    остальные ждут, пока блокировка освободится. В базу пишутся только
+    изменившиеся строки CFProblemStatistics и состояние контеста в
+    CFLiveContest, откуда его забирают воркеры.
+    """
+
+    def __init__(self, session_factory, poll_interval: float = LIVE_POLL_INTERVAL,
+                 list_interval: float = CONTEST_LIST_INTERVAL, lock_path: str = LIVE_TRACKER_LOCK):
+        self.session_factory = session_factory
+        self.poll_interval = poll_interval
+        self.list_interval = list_interval
+        self.lock_path = lock_path
+        self.contests: Dict[int, LiveContest] = {}  # по cf_contest_id
+        self.polls = 0
+        self.rows_written = 0
+        self.failures = 0
+        self._list_refreshed = 0.0
+
+    async def run(self):
+        with open(self.lock_path, "a") as lock_file:
+            if not acquire_tracker_lock(lock_file):
+                logger.info("Live tracker is running in another process, waiting for the lock")
+                while not acquire_tracker_lock(lock_file):
+                    await asyncio.sleep(self.list_interval)
+            logger.info("Live tracker started")
+            await self._poll_loop()
+
+    async def _poll_loop(self):
+        conn = aiohttp.TCPConnector(ssl=ssl_context)
+        async with aiohttp.ClientSession(connector=conn) as http_session:
+            while True:
+                started = time.monotonic()
+                try:
+                    ok = await self.poll_once(http_session)
+                except Exception as e:
+                    logger.error(f"Live tracker poll failed: {str(e)}")
+                    ok = False
+                self.failures = 0 if ok else self.failures + 1
+                interval = self.next_interval()
+                if self.failures:
+                    logger.warning(f"Live tracker: {self.failures} failed polls in a row, next in {interval:.0f}s")
+                await asyncio.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+    def next_interval(self) -> float:
+        """Интервал до следующего опроса: удваивается после каждой неудачи подряд"""
+        return min(self.poll_interval * 2 ** min(self.failures, 16), max(self.poll_interval, LIVE_MAX_BACKOFF))
+
+    async def poll_once(self, http_session) -> bool:
+        """Один цикл опроса; False, если список контестов или какая-то таблица не загрузились"""
+        ok = True
+        if time.monotonic() - self._list_refreshed >= self.list_interval:
+            ok = await self.refresh_contests(http_session)
+        for contest in list(self.contests.values()):
+            try:
+                ok = await self.poll_contest(http_session, contest) and ok
+            except Exception as e:
+                logger.error(f"Live contest {contest.data['id']} poll failed: {str(e)}")
+                ok = False
+            await asyncio.sleep(LIVE_REQUEST_DELAY)
+        return ok
+
+    async def refresh_contests(self, http_session) -> bool:
+        contests = await get_all_contests(http_session)
+        if contests is None:
+            return False
+        self._list_refreshed = time.monotonic()
+        contests = {contest['id']: contest for contest in contests}
+
+        ok = True
+        for cf_contest_id in list(self.contests):
+            data = contests.get(cf_contest_id)
+            if data is None or data['phase'] != 'CODING':
+                contest = self.contests.pop(cf_contest_id)
+                try:
+                    await self.finish_contest(http_session, contest, data)
+                except Exception as e:
+                    logger.error(f"Live contest {cf_contest_id} finish failed: {str(e)}")
+                    # Контест остается в опросе: завершение повторится при следующем обновлении списка
+                    self.contests[cf_contest_id] = contest
+                    ok = False
+        for cf_contest_id, data in contests.items():
+            if data['phase'] != 'CODING':
+                continue
+            if cf_contest_id in self.contests:
+                self.contests[cf_contest_id].data = data
+            else:
+                self.contests[cf_contest_id] = LiveContest(data)
+                logger.info(f"Tracking live contest {cf_contest_id}")
+
+        # Состояние, оставшееся от прошлого запуска, и давно закончившиеся контесты
+        now = time.time()
+        async with self.session_factory() as session:
+            await session.execute(
+                update(CFLiveContest)
+                .where(CFLiveContest.finished == False, CFLiveContest.cf_contest_id.not_in(list(self.contests)))
+                .values(finished=True, updated=now)
+            )
+            await session.execute(
+                delete(CFLiveContest)
+                .where(CFLiveContest.finished == True, CFLiveContest.updated < now - FINISHED_STATE_TTL)
+            )
+            await session.commit()
+        logger.info(f"Live tracker: {len(self.contests)} live contests, {self.polls} polls, {self.rows_written} rows written")
+        return ok
+
+    async def finish_contest(self, http_session, contest: LiveContest, data: Optional[dict]):
+        """Последний опрос и новая фаза контеста; воркеры разошлют подписчикам событие finished"""
+        await self.poll_contest(http_session, contest)
+        if contest.contest_id is not None:
+            async with self.session_factory() as session:
+                if data is not None:
+                    await write_batch(session, [('contest', build_contest_dict(data))])
+                contest.updated = time.time()
+                await self._write_state(session, contest, finished=True)
+                await session.commit()
+        logger.info(f"Live contest {contest.data['id']} is over")
+
+    async def poll_contest(self, http_session, contest: LiveContest) -> bool:
+        cf_contest_id = contest.data['id']
+        fetched = await get_contest_solved_counts(http_session, cf_contest_id)
+        self.polls += 1
+        if fetched is None:
+            logger.warning(f"Incomplete standings for live contest {cf_contest_id}")
+            return False
+        problems, solved = fetched
+
+        changed = {index: count for index, count in solved.items() if contest.solved.get(index) != count}
+        if not changed:
+            return True
+
+        previous = contest.solved, contest.updated
+        contest.solved, contest.updated = solved, time.time()
+        try:
+            async with self.session_factory() as session:
+                if contest.contest_id is None or set(changed) - set(contest.problem_ids):
+                    await self._write_full(session, contest, problems, solved)
+                    await self._write_state(session, contest)
+                    await session.commit()
+                    # В каталоге появились задачи: воркеры получат их через новый снимок
+                    await write_snapshot(session)
+                else:
+                    await self._write_changes(session, contest, changed)
+                    await self._write_state(session, contest)
+                    await session.commit()
+        except Exception:
+            # Не записанные изменения должны снова попасть в следующий опрос
+            contest.solved, contest.updated = previous
+            raise
+        self.rows_written += len(changed)
+        return True
+
+    async def _write_full(self, session, contest: LiveContest, problems: List[dict], solved: Dict[str, int]):
+        """Первая запись контеста или появление новой задачи: тот же путь, что и у fill_db"""
+        cf_contest_id = contest.data['id']
+        await write_batch(session, [('contest', build_contest_dict(contest.data))] + [
+            ('problem', build_problem_record(cf_contest_id, problem, None, None, solved[problem['index']]))
+            for problem in problems
+        ])
+        # Новые задачи могли быть уже решены отслеживаемыми хэндлами
+        await rebuild_solved_bitmaps(session)
+        contest.contest_id = (await session.execute(
+            select(CFContest.id).where(CFContest.cf_contest_id == cf_contest_id)
+        )).scalar_one()
+        uids = {f"{cf_contest_id}_{problem['index']}": problem['index'] for problem in problems}
+        contest.problem_ids = {
+            uids[uid]: problem_id
+            for uid, problem_id in (await session.execute(
+                select(CFProblem.problem_uid, CFProblem.id).where(CFProblem.problem_uid.in_(uids))
+            )).all()
+        }
+
+    async def _write_changes(self, session, contest: LiveContest, changed: Dict[str, int]):
+        rows = [
+            {'pid': contest.problem_ids[index], 'cid': contest.contest_id, 'solved_count': count}
+            for index, count in changed.items()
+        ]
+        table = CFProblemStatistics.__table__
+        await session.execute(
+            update(table)
+            .where(table.c.problem_id == bindparam('pid'), table.c.contest_id == bindparam('cid'))
+            .values(solved_count=bindparam('solved_count'), last_updated=func.now()),
+            rows
+        )
+        await record_solved_counts(session, [(row['pid'], row['cid'], row['solved_count']) for row in rows])
+        await materialize_documents(session, problem_ids=[row['pid'] for row in rows])
+
+    async def _write_state(self, session, contest: LiveContest, finished: bool = False):
+        stmt = sqlite_insert(CFLiveContest.__table__).values(
+            cf_contest_id=contest.data['id'],
+            contest_id=contest.contest_id,
+            name=contest.data.get('name'),
+            solved=json.dumps(contest.solved),
+            updated=contest.updated,
+            finished=finished
+        )
+        await session.execute(stmt.on_conflict_do_update(
+            index_elements=['cf_contest_id'],
+            set_={column: stmt.excluded[column] for column in ('contest_id', 'name', 'solved', 'updated', 'finished')}
+        ))
+
+
+class LiveContestFeed:
+    """Рассылка состояния идущих контестов подписчикам SSE внутри воркера.
+
+    Codeforces воркер не опрашивает: раз в LIVE_FEED_INTERVAL он перечитывает
+    CFLiveContest, который пишет LiveContestTracker, и превращает изменения в
+    события delta и finished.
+    """
+
+    def __init__(self, session_factory, interval: float = LIVE_FEED_INTERVAL):
+        self.session_factory = session_factory
+        self.interval = interval
+        self.contests: Dict[int, LiveContest] = {}  # по cf_contests.id
+        self.subscribers: Dict[int, Set[asyncio.Queue]] = {}  # по cf_contests.id
+
+    # --- Подписки ---
+    def get(self, contest_id: int) -> Optional[LiveContest]:
+        return self.contests.get(contest_id)
+
+    def subscribe(self, contest_id: int) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.subscribers.setdefault(contest_id, set()).add(queue)
+        contest = self.get(contest_id)
+        if contest is not None:
+            queue.put_nowait(contest.snapshot())
+        return queue
+
+    def unsubscribe(self, contest_id: int, queue: asyncio.Queue):
+        queues = self.subscribers.get(contest_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self.subscribers[contest_id]
+
+    def publish(self, contest: LiveContest, event: dict):
+        for queue in self.subscribers.get(contest.contest_id, ()):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Медленный клиент пропускает накопленные дельты и получает снимок целиком
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(contest.snapshot())
+
+    # --- Чтение состояния ---
+    async def run(self):
+        while True:
+            try:
+                async with self.session_factory() as session:
+                    await self.refresh(session)
+            except Exception as e:
+                logger.error(f"Live feed refresh failed: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    async def refresh(self, session):
+        rows = (await session.execute(select(CFLiveContest))).scalars().all()
+        seen = set()
+        for row in rows:
+            seen.add(row.contest_id)
+            contest = self.contests.get(row.contest_id)
+            if row.finished:
+                if contest is not None:
+                    self._finish(contest)
+                continue
+            if contest is None:
+                contest = self.contests[row.contest_id] = LiveContest({'id': row.cf_contest_id, 'name': row.name})
+                contest.contest_id = row.contest_id
+            elif contest.updated == row.updated:
+                continue
+
+            solved = json.loads(row.solved)
+            changed = {index: count for index, count in solved.items() if contest.solved.get(index) != count}
+            previous = contest.solved
+            contest.solved = solved
+            contest.updated = row.updated
+            if changed:
+                self.publish(contest, {
+                    'type': 'delta',
+                    'contest_id': contest.contest_id,
+                    'changes': {
+                        index: {'solved_count': count, 'delta': count - previous.get(index, 0)}
+                        for index, count in changed.items()
+                    },
+                    'updated': contest.updated,
+                })
+        for contest_id in set(self.contests) - seen:
+            self._finish(self.contests[contest_id])
+
+    def _finish(self, contest: LiveContest):
+        del self.contests[contest.contest_id]
+        self.publish(contest, {'type': 'finished', 'contest_id': contest.contest_id})
+
+    # --- Выдача ---
+    def live_contests(self) -> List[dict]:
+        return [contest.snapshot() for contest in self.contests.values()]
+
+    async def stream(self, contest_id: int):
+        """События контеста в формате SSE, пока клиент не отключится или контест не закончится"""
+        queue = self.subscribe(contest_id)
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), SSE_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+                if event['type'] == 'finished':
+                    return
+        finally:
+            self.unsubscribe(contest_id, queue)
+
+
+async def main(poll_interval: float, list_interval: float):
+    await create_tables()
+    tracker = LiveContestTracker(AsyncSessionLocal, poll_interval, list_interval)
+    try:
+        await tracker.run()
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Опрос таблиц идущих контестов Codeforces")
+    arg_parser.add_argument(
+        "--poll-interval", type=float, default=LIVE_POLL_INTERVAL,
+        help="Интервал опроса таблиц (секунды)"
+    )
+    arg_parser.add_argument(
+        "--list-interval", type=float, default=CONTEST_LIST_INTERVAL,
+        help="Интервал обновления списка контестов (секунды)"
+    )
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger('sqlalchemy.engine').setLevel(logging.WARNING)
+    asyncio.run(main(args.poll_interval, args.list_interval))
@@ -1,32 +1,139 @@
-from fastapi import FastAPI, Depends, HTTPException, Query, Request
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
-from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-import schemas, crud
-from database import get_db
+import schemas, crud, services, documents
+import youit_import
+from admission import AdmissionController, AdmissionMiddleware
+from live import LiveContestFeed, LiveContestTracker
+from database import engine, get_db, AsyncSessionLocal
+from init_db import create_tables
+from static_assets import PrecompressedAsset
 from typing import Optional, List
 from datetime import datetime
+from contextlib import asynccontextmanager
+import asyncio
+import logging
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
 
-templates = Jinja2Templates(directory="frontend")
+# Время кеширования ответов, которые строятся из индексов в памяти
+CATALOG_CACHE_MAX_AGE = 60
 
+FRONTEND_INDEX = "frontend/index.html"
+
+frontend = {}
+
+# Опрос Codeforces ведет отдельный процесс (python live.py), воркеры только рассылают SSE.
+# True — опрашивать и из приложения: удобно при одном воркере; при нескольких
+# опрос все равно ведет только тот, кто взял блокировку live.LIVE_TRACKER_LOCK
+RUN_LIVE_TRACKER = False
+
+live_feed = LiveContestFeed(AsyncSessionLocal)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Страница сжимается один раз, а не на каждый запрос
+    frontend["index"] = PrecompressedAsset.from_file(FRONTEND_INDEX)
+
+    # Базы, созданные до появления новых таблиц, дополняются без потери данных
+    try:
+        await create_tables()
+    except Exception as e:
+        logger.warning(f"Schema creation failed: {str(e)}")
+
+    # Открываем первое соединение и строим индексы до первого запроса
+    try:
+        async with AsyncSessionLocal() as db:
+            await services.problem_sampler.get(db)
+            await services.tag_index.get(db)
+    except Exception as e:
+        logger.warning(f"Cache warmup failed: {str(e)}")
+
+    # Состояние идущих контестов читается из базы, подписчики получают изменения
+    live_tasks = [asyncio.create_task(live_feed.run())]
+    if RUN_LIVE_TRACKER:
+        live_tasks.append(asyncio.create_task(LiveContestTracker(AsyncSessionLocal).run()))
+
+    yield
+
+    for task in live_tasks:
+        task.cancel()
+    for task in live_tasks:
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    await engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
+
+admission = AdmissionController()
+
+# Добавляется раньше CORS, чтобы ответы 429 тоже получали CORS-заголовки
+app.add_middleware(AdmissionMiddleware, controller=admission)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
+flights = services.SingleFlight()
+
+
+async def coalesced_response(
+        route: str, model, query, request: Optional[Request] = None, document: Optional[str] = None, **params
+) -> Optional[Response]:
+    """Одно выполнение query на маршрут и набор параметров; готовый JSON делят все ожидающие.
+
+    Если задан document, сначала отдается документ, собранный при синхронизации
+    (ключ — единственный параметр), и только без него выполняется query.
+    Ответ несет ETag по содержимому, совпавший If-None-Match получает 304.
+    Возвращает None, если query вернул None (для ответа 404).
+    """
+    async def execute():
+        async with AsyncSessionLocal() as db:
+            if document is not None:
+                stored = await documents.get_document(db, document, *params.values())
+                if stored is not None:
+                    return stored
+            result = await query(db, **params)
+            if result is None:
+                return None
+            return documents.render(model, result)
+
+    flight = await flights.do(flights.key(route, params), execute)
+    if flight is None:
+        return None
+    body, etag = flight
+    if request is not None and request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
 @app.get("/")
 async def root(request: Request):
-    return templates.TemplateResponse("index.html", {"request": request})
+    return frontend["index"].response(request)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return admission.render_metrics() + (
+        "# TYPE cfsystem_coalesced_queries_in_flight gauge\n"
+        f"cfsystem_coalesced_queries_in_flight {len(flights)}\n"
+        "# TYPE cfsystem_live_contests gauge\n"
+        f"cfsystem_live_contests {len(live_feed.contests)}\n"
+        "# TYPE cfsystem_live_subscribers gauge\n"
+        f"cfsystem_live_subscribers {sum(len(queues) for queues in live_feed.subscribers.values())}\n"
+    )
+
 # CF Контесты
 @app.get("/cf/contests/", response_model=List[schemas.CFContest])
 async def read_cf_contests(
+    request: Request,
     skip: int = 0,
     limit: int = 100,
     name: Optional[str] = Query(None, description="Фильтр по названию контеста"),
@@ -37,11 +144,13 @@ async def read_cf_contests(
     start_time_from: Optional[datetime] = Query(None, description="Начало периода времени проведения"),
     start_time_to: Optional[datetime] = Query(None, description="Конец периода времени проведения"),
     min_problems: Optional[int] = Query(None, description="Минимальное количество задач в контесте"),
-    max_problems: Optional[int] = Query(None, description="Максимальное количество задач в контесте"),
-    db: AsyncSession = Depends(get_db)
+    max_problems: Optional[int] = Query(None, description="Максимальное количество задач в контесте")
 ):
-    contests = await crud.get_cf_contests(
-        db,
+    return await coalesced_response(
+        "/cf/contests/",
+        List[schemas.CFContest],
+        crud.get_cf_contests,
+        request,
         skip=skip,
         limit=limit,
         name=name,
@@ -54,18 +163,21 @@ async def read_cf_contests(
         min_problems=min_problems,
         max_problems=max_problems
     )
-    return contests
 
 @app.get("/cf/contests/{contest_id}", response_model=schemas.CFContestWithProblems)
-async def read_cf_contest(contest_id: int, db: AsyncSession = Depends(get_db)):
-    contest = await crud.get_cf_contest(db, contest_id=contest_id)
-    if contest is None:
+async def read_cf_contest(request: Request, contest_id: int):
+    response = await coalesced_response(
+        "/cf/contests/{contest_id}", schemas.CFContestWithProblems, crud.get_cf_contest, request,
+        document=documents.CONTEST, contest_id=contest_id
+    )
+    if response is None:
         raise HTTPException(status_code=404, detail="CF Contest not found")
-    return contest
+    return response
 
 # CF Задачи
 @app.get("/cf/problems/", response_model=List[schemas.CFProblem])
 async def read_cf_problems(
+    request: Request,
     skip: int = 0,
     limit: int = 100,
     name: Optional[str] = Query(None, description="Фильтр по названию задачи"),
@@ -75,10 +187,14 @@ async def read_cf_problems(
     tags: Optional[List[str]] = Query(None, description="Список тегов через запятую"),
     contest_id: Optional[int] = Query(None, description="ID контеста для фильтрации задач"),
     min_solved_count: Optional[int] = Query(None, description="Минимальное количество решений"),
-    db: AsyncSession = Depends(get_db)
+    solved_by: Optional[List[str]] = Query(None, description="Задачи, решенные всеми этими хэндлами"),
+    unsolved_by: Optional[List[str]] = Query(None, description="Задачи, не решенные ни одним из этих хэндлов")
 ):
-    problems = await crud.get_cf_problems(
-        db,
+    response = await coalesced_response(
+        "/cf/problems/",
+        List[schemas.CFProblem],
+        crud.get_cf_problems,
+        request,
         skip=skip,
         limit=limit,
         name=name,
@@ -87,20 +203,72 @@ async def read_cf_problems(
         include_null_rating=include_null_rating,
         tags=tags,
         contest_id=contest_id,
-        min_solved_count=min_solved_count
+        min_solved_count=min_solved_count,
+        solved_by=solved_by,
+        unsolved_by=unsolved_by
+    )
+    if response is None:
+        raise HTTPException(status_code=404, detail="Handle is not tracked")
+    return response
+
+@app.get("/cf/problems/random", response_model=List[schemas.CFProblem])
+async def read_random_cf_problems(
+    count: int = Query(10, ge=1, le=100, description="Количество задач в выборке"),
+    min_rating: Optional[int] = Query(None, description="Минимальный рейтинг задачи"),
+    max_rating: Optional[int] = Query(None, description="Максимальный рейтинг задачи"),
+    include_null_rating: Optional[bool] = Query(False, description="Включать задачи без рейтинга"),
+    tags: Optional[List[str]] = Query(None, description="Список тегов через запятую"),
+    exclude: Optional[List[str]] = Query(None, description="problem_uid уже просмотренных задач"),
+    seed: Optional[int] = Query(None, description="Seed для воспроизводимой выборки"),
+    db: AsyncSession = Depends(get_db)
+):
+    sampler = await services.problem_sampler.get(db)
+    return sampler.sample(
+        count,
+        min_rating=min_rating,
+        max_rating=max_rating,
+        include_null_rating=include_null_rating,
+        tags=tags,
+        exclude=exclude,
+        seed=seed
     )
-    return problems
+
+@app.get("/cf/problems/trending", response_model=List[schemas.CFTrendingProblem])
+async def read_trending_cf_problems(
+    days: int = Query(7, ge=1, le=3650, description="Период в днях"),
+    limit: int = Query(20, ge=1, le=100, description="Количество задач"),
+    db: AsyncSession = Depends(get_db)
+):
+    rows = await crud.get_trending_cf_problems(db, days=days, limit=limit)
+    return [
+        {**schemas.CFProblem.model_validate(problem).model_dump(), 'growth': growth}
+        for problem, growth in rows
+    ]
 
 @app.get("/cf/problems/{problem_id}", response_model=schemas.CFProblemWithDetails)
-async def read_cf_problem(problem_id: int, db: AsyncSession = Depends(get_db)):
-    problem = await crud.get_cf_problem(db, problem_id=problem_id)
-    if problem is None:
+async def read_cf_problem(request: Request, problem_id: int):
+    response = await coalesced_response(
+        "/cf/problems/{problem_id}", schemas.CFProblemWithDetails, crud.get_cf_problem, request,
+        document=documents.PROBLEM, problem_id=problem_id
+    )
+    if response is None:
         raise HTTPException(status_code=404, detail="CF Problem not found")
-    return problem
+    return response
+
+@app.get("/cf/problems/{problem_id}/history", response_model=List[schemas.CFSolvedCountPoint])
+async def read_cf_problem_history(
+    problem_id: int,
+    resolution: str = Query("day", pattern="^(raw|day|week|month)$", description="raw, day, week или month"),
+    since: Optional[datetime] = Query(None, description="Начало периода"),
+    contest_id: Optional[int] = Query(None, description="ID контеста: только ряд задачи в этом контесте"),
+    db: AsyncSession = Depends(get_db)
+):
+    return await crud.get_cf_problem_history(db, problem_id, resolution=resolution, since=since, contest_id=contest_id)
 
 # Задачи CF контеста
 @app.get("/cf/contests/{contest_id}/problems/", response_model=List[schemas.CFProblem])
 async def read_cf_contest_problems(
+    request: Request,
     contest_id: int,
     skip: int = 0,
     limit: int = 100,
@@ -108,11 +276,13 @@ async def read_cf_contest_problems(
     min_rating: Optional[int] = Query(None, description="Минимальный рейтинг задачи"),
     max_rating: Optional[int] = Query(None, description="Максимальный рейтинг задачи"),
     tags: Optional[List[str]] = Query(None, description="Список тегов через запятую"),
-    min_solved_count: Optional[int] = Query(None, description="Минимальное количество решений"),
-    db: AsyncSession = Depends(get_db)
+    min_solved_count: Optional[int] = Query(None, description="Минимальное количество решений")
 ):
-    problems = await crud.get_cf_contest_problems(
-        db,
+    response = await coalesced_response(
+        "/cf/contests/{contest_id}/problems/",
+        List[schemas.CFProblem],
+        _contest_problems_or_none,
+        request,
         contest_id=contest_id,
         skip=skip,
         limit=limit,
@@ -122,6 +292,67 @@ async def read_cf_contest_problems(
         tags=tags,
         min_solved_count=min_solved_count
     )
-    if not problems:
+    if response is None:
         raise HTTPException(status_code=404, detail="No problems found for this contest with specified filters")
-    return problems
\ No newline at end of file
+    return response
+
+async def _contest_problems_or_none(db: AsyncSession, **params):
+    return await crud.get_cf_contest_problems(db, **params) or None
+
+# Идущие контесты
+@app.get("/cf/live/contests")
+async def read_live_contests():
+    return live_feed.live_contests()
+
+@app.get("/cf/live/contests/{contest_id}")
+async def stream_live_contest(contest_id: int):
+    if live_feed.get(contest_id) is None:
+        raise HTTPException(status_code=404, detail="Contest is not live")
+    return StreamingResponse(
+        live_feed.stream(contest_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# Импорт в YouIT
+@app.post("/youit/import", response_model=schemas.YouITImportResult)
+async def import_cf_contests(request: schemas.YouITImportRequest, db: AsyncSession = Depends(get_db)):
+    if not request.cf_contest_ids and request.problem_filter is None:
+        raise HTTPException(status_code=400, detail="Pass cf_contest_ids or problem_filter")
+    created = await youit_import.import_cf_contests_to_youit(
+        db,
+        cf_contest_ids=request.cf_contest_ids,
+        problem_filter=request.problem_filter.model_dump() if request.problem_filter else None
+    )
+    await db.commit()
+    return created
+
+# CF Теги
+def _cached_tag_response(request: Request, response: Response, index: services.TagIndex):
+    if request.headers.get("if-none-match") == index.etag:
+        return Response(status_code=304, headers={"ETag": index.etag})
+    response.headers["ETag"] = index.etag
+    response.headers["Cache-Control"] = f"public, max-age={CATALOG_CACHE_MAX_AGE}"
+    return None
+
+@app.get("/cf/tags/", response_model=List[schemas.CFTagWithCount])
+async def read_cf_tags(request: Request, response: Response, db: AsyncSession = Depends(get_db)):
+    index = await services.tag_index.get(db)
+    not_modified = _cached_tag_response(request, response, index)
+    if not_modified is not None:
+        return not_modified
+    return index.tags
+
+@app.get("/cf/tags/suggest", response_model=List[schemas.CFTagWithCount])
+async def suggest_cf_tags(
+    request: Request,
+    response: Response,
+    prefix: str = Query("", description="Начало названия тега"),
+    limit: int = Query(10, ge=1, le=50, description="Максимальное количество подсказок"),
+    db: AsyncSession = Depends(get_db)
+):
+    index = await services.tag_index.get(db)
+    not_modified = _cached_tag_response(request, response, index)
+    if not_modified is not None:
+        return not_modified
+    return index.suggest(prefix, limit)
@@ -1,6 +1,6 @@
 from sqlalchemy import (
     Column, Integer, String, Boolean, ForeignKey,
-    DateTime, Float, Table, Text, Enum
+    DateTime, Float, Table, Text, Enum, LargeBinary, UniqueConstraint, Index
 )
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
@@ -60,6 +60,13 @@ class Language(Base):
     name = Column(String(50), unique=True)
 
 
+class DatabaseInfo(Base):
+    """Служебные значения базы. instance — случайный id, новый у каждой заново созданной базы"""
+    __tablename__ = 'database_info'
+    key = Column(String(50), primary_key=True)
+    value = Column(String(100), nullable=False)
+
+
 class User(Base):
     __tablename__ = 'users'
     id = Column(Integer, primary_key=True)
@@ -78,7 +85,7 @@ class YouITContest(Base):
     duration = Column(Integer)
     is_archived = Column(Boolean, default=False)
     creator_id = Column(Integer, ForeignKey('users.id'))
-    cf_contest_id = Column(Integer, nullable=True)
+    cf_contest_id = Column(Integer, nullable=True, index=True)
 
     creator = relationship("User")
     problems = relationship(
@@ -118,7 +125,7 @@ class CFProblemReference(Base):
     __tablename__ = 'cf_problem_references'
     id = Column(Integer, primary_key=True)
     youit_problem_id = Column(Integer, ForeignKey('youit_problems.id'), unique=True)
-    cf_problem_id = Column(Integer, ForeignKey('cf_problems.id'))
+    cf_problem_id = Column(Integer, ForeignKey('cf_problems.id'), index=True)
 
     youit_problem = relationship("YouITProblem", back_populates="cf_reference")
     cf_problem = relationship("CFProblem", back_populates="youit_references")
@@ -160,6 +167,82 @@ class CFProblemStatistics(Base):
     contest = relationship("CFContest")
 
 
+class CFSolvedCountChunk(Base):
+    """Сырые замеры solved_count: пары (время, значение) в виде дельт в varint.
+
+    Ряд ведется по строке статистики (задача, контест): одна задача в двух
+    контестах — два независимых ряда.
+    """
+    __tablename__ = 'cf_solved_count_chunks'
+    __table_args__ = (
+        Index('ix_cf_solved_count_chunks_series', 'problem_id', 'contest_id'),
+    )
+    id = Column(Integer, primary_key=True)
+    problem_id = Column(Integer, ForeignKey('cf_problems.id'), nullable=False)
+    contest_id = Column(Integer, ForeignKey('cf_contests.id'), nullable=False)
+    start_ts = Column(Integer, nullable=False)
+    last_ts = Column(Integer, nullable=False)
+    last_value = Column(Integer, nullable=False)
+    sample_count = Column(Integer, nullable=False, default=0)
+    data = Column(LargeBinary, nullable=False)
+
+
+class CFSolvedCountRollup(Base):
+    """Агрегаты solved_count за день, неделю или месяц"""
+    __tablename__ = 'cf_solved_count_rollups'
+    __table_args__ = (
+        UniqueConstraint('problem_id', 'contest_id', 'period', 'period_start'),
+        Index('ix_cf_solved_count_rollups_period', 'period', 'period_start'),
+    )
+    id = Column(Integer, primary_key=True)
+    problem_id = Column(Integer, ForeignKey('cf_problems.id'), nullable=False)
+    contest_id = Column(Integer, ForeignKey('cf_contests.id'), nullable=False)
+    period = Column(String(5), nullable=False)  # day, week, month
+    period_start = Column(Integer, nullable=False)  # номер дня от эпохи
+    first_value = Column(Integer, nullable=False)
+    last_value = Column(Integer, nullable=False)
+    min_value = Column(Integer, nullable=False)
+    max_value = Column(Integer, nullable=False)
+
+
+class CFTrackedHandle(Base):
+    """Отслеживаемый хэндл Codeforces и множество решенных им задач"""
+    __tablename__ = 'cf_tracked_handles'
+    id = Column(Integer, primary_key=True)
+    # Хэндлы Codeforces нечувствительны к регистру: хранится в нижнем
+    handle = Column(String(50), unique=True, nullable=False)
+    # Самая новая обработанная посылка: следующая загрузка останавливается на ней
+    last_submission_id = Column(Integer, nullable=False, default=0)
+    # problem_uid всех принятых задач через запятую, в том числе еще не попавших в каталог
+    solved_uids = Column(Text, nullable=False, default='')
+    # Битовая карта по cf_problems.id (little-endian), бит i — задача i решена.
+    # Собирается из solved_uids при каждой синхронизации
+    solved_bitmap = Column(LargeBinary, nullable=False, default=b'')
+    solved_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+
+class CFLiveContest(Base):
+    """Состояние идущего контеста: пишет единственный процесс опроса, воркеры рассылают его по SSE"""
+    __tablename__ = 'cf_live_contests'
+    cf_contest_id = Column(Integer, primary_key=True)
+    contest_id = Column(Integer, ForeignKey('cf_contests.id'), nullable=False)
+    name = Column(String(100))
+    solved = Column(Text, nullable=False)  # JSON {index: solved_count}
+    updated = Column(Float, nullable=False)  # unix time последнего изменения
+    finished = Column(Boolean, nullable=False, default=False)
+
+
+class CFDetailDocument(Base):
+    """Готовый JSON детального ответа по контесту или задаче, собранный при синхронизации"""
+    __tablename__ = 'cf_detail_documents'
+    kind = Column(String(10), primary_key=True)  # contest, problem
+    object_id = Column(Integer, primary_key=True)
+    body = Column(LargeBinary, nullable=False)
+    etag = Column(String(20), nullable=False)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+
 class CFProblem(Base):
     __tablename__ = 'cf_problems'
     id = Column(Integer, primary_key=True)
@@ -0,0 +1,172 @@
+import codecs
+import json
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+# Размер куска, читаемого из сокета за раз
+STREAM_CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE = " \t\n\r"
+_decoder = json.JSONDecoder()
+
+Path = Tuple[str, ...]
+
+
+class _Frame:
+    __slots__ = ("is_array", "path", "key", "expect")
+
+    def __init__(self, is_array: bool, path: Path):
+        self.is_array = is_array
+        self.path = path
+        self.key: Optional[str] = None
+        # Для объекта: key -> colon -> value -> comma; для массива: value -> comma
+        self.expect = "value" if is_array else "key"
+
+
+async def iter_json_arrays(
+        chunks: AsyncIterator[bytes],
+        targets: Iterable[Path],
+        captured: Optional[Dict[Path, Any]] = None
+) -> AsyncIterator[Tuple[Path, Any]]:
+    """Инкрементальный разбор JSON: отдает элементы массивов по путям targets по мере чтения.
+
+    В памяти держится только текущий элемент и непрочитанный хвост буфера.
+    Остальные значения по пути, не ведущему к целям, разбираются целиком и,
+    если передан captured, сохраняются в нем (например, status и comment).
+    """
+    targets = {tuple(target) for target in targets}
+    prefixes = {target[:i] for target in targets for i in range(len(target))}
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+
+    buf = ""
+    pos = 0
+    eof = False
+    stack: List[_Frame] = []
+    done = False
+    chunks = chunks.__aiter__()
+
+    while not done:
+        progressed = True
+        while progressed and not done:
+            progressed = False
+            while pos < len(buf) and buf[pos] in _WHITESPACE:
+                pos += 1
+            if pos >= len(buf):
+                break
+
+            frame = stack[-1] if stack else None
+            char = buf[pos]
+
+            if frame is not None and frame.expect == "comma":
+                if char == ",":
+                    pos += 1
+                    frame.expect = "value" if frame.is_array else "key"
+                elif char in "]}":
+                    pos += 1
+                    stack.pop()
+                    if not stack:
+                        done = True
+                    else:
+                        stack[-1].expect = "comma"
+                else:
+                    raise ValueError(f"Unexpected character {char!r} in JSON stream")
+                progressed = True
+                continue
+
+            if frame is not None and frame.expect == "colon":
+                if char != ":":
+                    raise ValueError(f"Unexpected character {char!r} in JSON stream")
+                pos += 1
+                frame.expect = "value"
+                progressed = True
+                continue
+
+            if frame is not None and frame.expect == "key":
+                if char == "}":
+                    pos += 1
+                    stack.pop()
+                    if not stack:
+                        done = True
+                    else:
+                        stack[-1].expect = "comma"
+                    progressed = True
+                    continue
+                if char != '"':
+                    raise ValueError(f"Unexpected character {char!r} in JSON stream")
+                decoded = _try_decode(buf, pos, eof)
+                if decoded is None:
+                    break
+                frame.key, pos = decoded
+                frame.expect = "colon"
+                progressed = True
+                continue
+
+            # Ожидается значение
+            if frame is None:
+                path: Path = ()
+            elif frame.is_array:
+                if char == "]":
+                    pos += 1
+                    stack.pop()
+                    if not stack:
+                        done = True
+                    else:
+                        stack[-1].expect = "comma"
+                    progressed = True
+                    continue
+                path = frame.path
+            else:
+                path = frame.path + (frame.key,)
+
+            if frame is not None and frame.is_array and frame.path in targets:
+                decoded = _try_decode(buf, pos, eof)
+                if decoded is None:
+                    break
+                item, pos = decoded
+                frame.expect = "comma"
+                yield path, item
+            elif (char == "{" and path in prefixes) or (char == "[" and path in targets):
+                pos += 1
+                stack.append(_Frame(char == "[", path))
+            else:
+                decoded = _try_decode(buf, pos, eof)
+                if decoded is None:
+                    break
+                value, pos = decoded
+                if captured is not None:
+                    captured[path] = value
+                if frame is None:
+                    done = True
+                else:
+                    frame.expect = "comma"
+            progressed = True
+
+        if done:
+            break
+        if eof:
+            if pos < len(buf) or stack:
+                raise ValueError("Unexpected end of JSON stream")
+            break
+
+        buf = buf[pos:]
+        pos = 0
+        try:
+            chunk = await chunks.__anext__()
+            buf += text_decoder.decode(chunk)
+        except StopAsyncIteration:
+            buf += text_decoder.decode(b"", final=True)
+            eof = True
+
+
+def _try_decode(buf: str, pos: int, eof: bool) -> Optional[Tuple[Any, int]]:
+    """Разбор одного значения; None, если значение может продолжиться в следующем куске"""
+    try:
+        value, end = _decoder.raw_decode(buf, pos)
+    except json.JSONDecodeError:
+        if eof:
+            raise
+        return None
+    # Число на границе куска могло быть обрезано
+    if end >= len(buf) and not eof:
+        return None
+    return value, end
+
@@ -0,0 +1,240 @@
+"""Аудит планов запросов crud: все комбинации фильтров прогоняются через EXPLAIN QUERY PLAN
+на синтетической базе, в отчет попадают полные сканы, временные B-деревья и автоматические индексы.
+
+Запуск: python plan_audit.py [--verbose] [--update-baseline]. Код возврата 1, если у какой-либо
+комбинации фильтров появились находки, которых нет в ее строке BASELINE_FILE,
+поэтому скрипт можно ставить в CI перед деплоем.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Set, Tuple
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.dialects import sqlite
+
+import crud
+import models
+from database import Base
+
+# Размер синтетической базы
+SYNTHETIC_CONTESTS = 2000
+SYNTHETIC_PROBLEMS_PER_CONTEST = 6
+SYNTHETIC_TAGS = [
+    "implementation", "math", "greedy", "dp", "data structures", "brute force",
+    "constructive algorithms", "graphs", "sortings", "binary search", "dfs and similar",
+    "trees", "strings", "number theory", "combinatorics", "two pointers", "bitmasks",
+    "geometry", "dsu", "shortest paths", "probabilities", "divide and conquer",
+    "hashing", "games", "interactive", "flows", "matrices", "fft", "graph matchings",
+]
+
+# Значения фильтров для каждой функции crud; перебираются все подмножества
+QUERY_SHAPES = {
+    "get_cf_contests": (crud.cf_contests_query, {}, {
+        "name": "Round",
+        "contest_type": "CF",
+        "phase": "FINISHED",
+        "min_duration": 60,
+        "max_duration": 300,
+        "start_time_from": datetime(2020, 1, 1),
+        "start_time_to": datetime(2024, 1, 1),
+        "min_problems": 3,
+        "max_problems": 8,
+    }),
+    "get_cf_problems": (crud.cf_problems_query, {}, {
+        "name": "tree",
+        "min_rating": 1600,
+        "max_rating": 1900,
+        "include_null_rating": True,
+        "tags": ["dp", "math"],
+        "contest_id": 42,
+        "min_solved_count": 100,
+        "problem_ids": list(range(1, 2000, 3)),
+    }),
+    "get_cf_contest_problems": (crud.cf_contest_problems_query, {"contest_id": 42}, {
+        "name": "tree",
+        "min_rating": 1600,
+        "max_rating": 1900,
+        "tags": ["dp", "math"],
+        "min_solved_count": 100,
+    }),
+}
+
+# Принятые находки по каждой комбинации фильтров: {"функция[фильтры]": [находки]}.
+# Комбинации без находок в файле не хранятся. Все, что сверх базовой линии комбинации,
+# считается регрессией. После добавления индекса базовую линию нужно перезаписать
+# (--update-baseline), чтобы исправленное не вернулось.
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "plan_audit_baseline.json")
+
+
+def create_synthetic_db(path: str, seed: int = 0):
+    """Синтетическая база с распределениями, похожими на каталог Codeforces"""
+    rng = random.Random(seed)
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+
+    start = datetime(2010, 1, 1)
+    contests, problems, contest_links, tag_links, statistics = [], [], [], [], []
+    for contest_id in range(1, SYNTHETIC_CONTESTS + 1):
+        contests.append({
+            "id": contest_id,
+            "cf_contest_id": contest_id,
+            "name": f"Codeforces Round {contest_id}",
+            "type": rng.choice(["CF", "ICPC", "IOI"]),
+            "phase": "FINISHED",
+            "start_time": start + timedelta(days=contest_id * 2),
+            "duration": rng.choice([120, 135, 150, 180, 300]),
+            "contest_url": f"https://codeforces.com/contest/{contest_id}",
+        })
+        for index in "ABCDEFGH"[:SYNTHETIC_PROBLEMS_PER_CONTEST]:
+            problem_id = len(problems) + 1
+            problems.append({
+                "id": problem_id,
+                "problem_uid": f"{contest_id}_{index}",
+                "cf_problem_index": index,
+                "name": f"Problem {contest_id}{index}",
+                "rating": rng.choice([None] + list(range(800, 3600, 100))),
+                "problem_url": f"https://codeforces.com/contest/{contest_id}/problem/{index}",
+            })
+            contest_links.append({"problem_id": problem_id, "contest_id": contest_id})
+            for tag_id in rng.sample(range(1, len(SYNTHETIC_TAGS) + 1), rng.randint(1, 4)):
+                tag_links.append({"problem_id": problem_id, "tag_id": tag_id})
+            statistics.append({
+                "problem_id": problem_id,
+                "contest_id": contest_id,
+                "solved_count": rng.randint(0, 50000),
+            })
+
+    with engine.begin() as conn:
+        conn.execute(insert(models.CFTag), [{"id": i + 1, "name": name} for i, name in enumerate(SYNTHETIC_TAGS)])
+        conn.execute(insert(models.CFContest), contests)
+        conn.execute(insert(models.CFProblem), problems)
+        conn.execute(insert(models.cf_problem_contest_association), contest_links)
+        conn.execute(insert(models.cf_problem_tag_association), tag_links)
+        conn.execute(insert(models.CFProblemStatistics), statistics)
+        conn.exec_driver_sql("ANALYZE")
+    return engine
+
+
+def iter_shapes():
+    """Все комбинации фильтров: (функция, включенные фильтры, запрос)"""
+    for function, (builder, required, filters) in QUERY_SHAPES.items():
+        names = sorted(filters)
+        for size in range(len(names) + 1):
+            for combination in itertools.combinations(names, size):
+                params = dict(required, **{name: filters[name] for name in combination})
+                yield function, combination, builder(**params)
+
+
+def classify(detail: str) -> str:
+    """Находка по строке EXPLAIN QUERY PLAN или пустая строка"""
+    words = detail.split()
+    if "AUTOMATIC" in words:
+        return f"automatic-index {words[1]}"
+    if detail.startswith("USE TEMP B-TREE"):
+        return f"temp-btree {detail[len('USE TEMP B-TREE FOR '):]}"
+    if words[0] == "SCAN":
+        if "VIRTUAL" in words:
+            # json_each по списку id из параметра читается целиком, это не скан таблицы
+            return ""
+        if "INDEX" in words:
+            return f"index-scan {words[1]}"
+        return f"full-scan {words[1]}"
+    return ""
+
+
+def explain(conn, query) -> List[str]:
+    compiled = query.compile(dialect=sqlite.dialect(), compile_kwargs={"literal_binds": True})
+    rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}").all()
+    return [row[3] for row in rows]
+
+
+def shape_name(function: str, combination: Tuple[str, ...]) -> str:
+    return f"{function}[{', '.join(combination)}]"
+
+
+def load_baseline(path: str = BASELINE_FILE) -> Dict[str, Set[str]]:
+    with open(path, encoding="utf-8") as file:
+        return {shape: set(findings) for shape, findings in json.load(file).items()}
+
+
+def save_baseline(report, path: str = BASELINE_FILE):
+    baseline = {
+        shape_name(function, combination): sorted(findings)
+        for function, combination, _, findings in report
+        if findings
+    }
+    # Одна комбинация — одна строка, чтобы изменения базовой линии читались в диффе
+    lines = [f"  {json.dumps(shape)}: {json.dumps(findings)}" for shape, findings in sorted(baseline.items())]
+    with open(path, "w", encoding="utf-8") as file:
+        file.write("{\n" + ",\n".join(lines) + "\n}\n")
+
+
+def audit(engine) -> List[Tuple[str, Tuple[str, ...], List[str], Set[str]]]:
+    report = []
+    with engine.connect() as conn:
+        for function, combination, query in iter_shapes():
+            plan = explain(conn, query)
+            findings = {finding for finding in map(classify, plan) if finding}
+            report.append((function, combination, plan, findings))
+    return report
+
+
+def main(argv=None) -> int:
+    arg_parser = argparse.ArgumentParser(description="Аудит планов запросов crud")
+    arg_parser.add_argument("--verbose", action="store_true", help="Печатать план каждого запроса")
+    arg_parser.add_argument(
+        "--update-baseline", action="store_true",
+        help="Записать текущие находки как принятые вместо проверки"
+    )
+    args = arg_parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_synthetic_db(os.path.join(directory, "plan_audit.db"))
+        try:
+            report = audit(engine)
+        finally:
+            engine.dispose()
+
+    if args.update_baseline:
+        save_baseline(report)
+        print(f"Baseline written to {BASELINE_FILE}")
+        return 0
+    baseline = load_baseline()
+
+    totals = defaultdict(lambda: defaultdict(int))
+    regressions = []
+    for function, combination, plan, findings in report:
+        shape = shape_name(function, combination)
+        for finding in findings:
+            totals[function][finding] += 1
+        unexpected = findings - baseline.get(shape, set())
+        if unexpected:
+            regressions.append((shape, sorted(unexpected)))
+        if args.verbose:
+            print(shape)
+            for line in plan:
+                print(f"    {line}")
+
+    for function, findings in totals.items():
+        shapes = sum(1 for item in report if item[0] == function)
+        print(f"{function}: {shapes} shapes")
+        for finding, count in sorted(findings.items()):
+            print(f"    {finding}: {count}")
+
+    if regressions:
+        print(f"\n{len(regressions)} shapes with findings outside the baseline:")
+        for shape, findings in regressions:
+            print(f"    {shape}: {', '.join(findings)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -16,6 +16,9 @@ class CFTag(BaseModel):
     class Config:
         from_attributes = True
 
+class CFTagWithCount(CFTag):
+    problems_count: int
+
 class CFProblemStatistics(BaseModel):
     id: int
     solved_count: int
@@ -54,4 +57,30 @@ class CFProblem(BaseModel):
 class CFProblemWithDetails(CFProblem):
     contests: List[CFContest]
     tags: List[CFTag]
-    statistics: Optional[List['CFProblemStatistics']] = None
\ No newline at end of file
+    statistics: Optional[List['CFProblemStatistics']] = None
+
+class CFTrendingProblem(CFProblem):
+    growth: int
+
+class CFSolvedCountPoint(BaseModel):
+    contest_id: int
+    timestamp: datetime
+    solved_count: int
+
+class CFProblemFilter(BaseModel):
+    name: Optional[str] = None
+    min_rating: Optional[int] = None
+    max_rating: Optional[int] = None
+    include_null_rating: bool = False
+    tags: Optional[List[str]] = None
+    min_solved_count: Optional[int] = None
+
+class YouITImportRequest(BaseModel):
+    cf_contest_ids: Optional[List[int]] = None
+    problem_filter: Optional[CFProblemFilter] = None
+
+class YouITImportResult(BaseModel):
+    contests: int
+    problems: int
+    contest_links: int
+    language_links: int
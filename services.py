@@ -0,0 +1,263 @@
+import asyncio
+import hashlib
+import os
+import random
+import time
+from bisect import bisect_left, bisect_right
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import crud
+import snapshot
+from database import DATABASE_PATH
+from snapshot import CatalogSnapshot, rating_bucket
+
+# Как часто (в секундах) проверять, не появился ли новый снимок или не изменилась ли база
+VERSION_CHECK_INTERVAL = 1.0
+
+
+def catalog_version() -> Tuple[int, int]:
+    """Версия каталога по файлу базы: меняется после каждой записи fill_db"""
+    version = (0, 0)
+    for path in (DATABASE_PATH, f"{DATABASE_PATH}-wal"):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        version = (max(version[0], st.st_mtime_ns), version[1] + st.st_size)
+    return version
+
+
+class SnapshotLoader:
+    """Текущий снимок каталога воркера.
+
+    Если синхронизация записала файл снимка, он отображается через mmap: страницы
+    общие для всех воркеров, переключение на новую версию — по указателю CURRENT.
+    Файл используется, только пока отпечаток каталога в базе совпадает с записанным
+    в указателе: после пересоздания базы или записи в обход снимка он устарел.
+    Без подходящего файла снимок собирается в памяти из базы и пересобирается при ее изменении.
+    """
+
+    def __init__(self, directory: str = snapshot.SNAPSHOT_DIR):
+        self.directory = directory
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._version = None
+        self._checked_at = 0.0
+        self._stamp = None
+        self._stamp_version = None
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        self._version = None
+        self._checked_at = 0.0
+        self._stamp_version = None
+
+    async def _catalog_stamp(self, db: AsyncSession) -> Optional[str]:
+        """Отпечаток каталога в базе; запрашивается заново, только если изменился файл базы"""
+        db_version = catalog_version()
+        if db_version != self._stamp_version:
+            try:
+                self._stamp = await crud.get_cf_catalog_stamp(db)
+            except OperationalError:
+                # База без служебной таблицы: снимку не с чем сверяться
+                await db.rollback()
+                self._stamp = None
+            self._stamp_version = db_version
+        return self._stamp
+
+    async def _current_version(self, db: AsyncSession):
+        pointer = snapshot.current_snapshot(self.directory)
+        if pointer is not None:
+            name, stamp = pointer
+            if await self._catalog_stamp(db) == stamp:
+                return ('file', name)
+        return ('db', catalog_version())
+
+    async def get(self, db: AsyncSession) -> CatalogSnapshot:
+        now = time.monotonic()
+        if self._snapshot is not None and now - self._checked_at < VERSION_CHECK_INTERVAL:
+            return self._snapshot
+
+        version = await self._current_version(db)
+        self._checked_at = now
+        if self._snapshot is not None and version == self._version:
+            return self._snapshot
+
+        async with self._lock:
+            if self._snapshot is None or self._version != version:
+                kind, name = version
+                if kind == 'file':
+                    try:
+                        self._snapshot = snapshot.open_snapshot(name, self.directory)
+                    except FileNotFoundError:
+                        # Файл уже заменен следующей синхронизацией: подхватим его при следующей проверке
+                        if self._snapshot is not None:
+                            return self._snapshot
+                        version = ('db', catalog_version())
+                if version[0] == 'db':
+                    self._snapshot = CatalogSnapshot(await snapshot.build_catalog(db), 'memory')
+                self._version = version
+        return self._snapshot
+
+
+catalog = SnapshotLoader()
+
+
+class CatalogCache:
+    """Индекс поверх текущего снимка каталога; пересоздается при смене версии снимка"""
+
+    def __init__(self, builder: Callable[[CatalogSnapshot], Any]):
+        self._builder = builder
+        self._index = None
+        self._snapshot = None
+
+    async def get(self, db: AsyncSession):
+        current = await catalog.get(db)
+        if current is not self._snapshot:
+            self._index = self._builder(current)
+            self._snapshot = current
+        return self._index
+
+
+class SingleFlight:
+    """Объединение одинаковых одновременных запросов: на ключ выполняется только один вызов"""
+
+    def __init__(self):
+        self._flights: Dict[Hashable, asyncio.Future] = {}
+
+    @staticmethod
+    def key(route: str, params: Dict[str, Any]) -> Hashable:
+        """Ключ из маршрута и нормализованных параметров (порядок списков не важен)"""
+        normalized = []
+        for name, value in sorted(params.items()):
+            if value is None or value == []:
+                continue
+            if isinstance(value, (list, tuple, set)):
+                value = tuple(sorted(value))
+            normalized.append((name, value))
+        return route, tuple(normalized)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._flights.get(key)
+        if future is None:
+            # Выполнение не привязано к запросу-лидеру: его отмена не затронет остальных
+            future = asyncio.ensure_future(fn())
+            self._flights[key] = future
+            future.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(future)
+
+    def _finish(self, key: Hashable, future: asyncio.Future):
+        if self._flights.get(key) is future:
+            del self._flights[key]
+        if not future.cancelled():
+            future.exception()
+
+    def __len__(self):
+        return len(self._flights)
+
+
+class ProblemSampler:
+    """Случайная выборка задач по рейтинговым корзинам и тегам без обращения к базе.
+
+    Работает с номерами строк снимка: внутри корзины они идут по возрастанию id,
+    постинги тегов ограничиваются корзиной двоичным поиском.
+    """
+
+    def __init__(self, catalog_snapshot: CatalogSnapshot):
+        self.snapshot = catalog_snapshot
+        self.bucket_keys = sorted(key for key in catalog_snapshot.buckets if key is not None)
+
+    def _candidates(self, bucket: Optional[int], tags: List[str]) -> List[int]:
+        bounds = self.snapshot.buckets.get(bucket)
+        if bounds is None:
+            return []
+        if not tags:
+            return list(range(*bounds))
+
+        postings = [self.snapshot.tag_postings(tag, *bounds) for tag in tags]
+        if not all(postings):
+            return []
+        postings.sort(key=len)
+        if len(postings) == 1:
+            return list(postings[0])
+        others = set(postings[1]).intersection(*postings[2:])
+        return [row for row in postings[0] if row in others]
+
+    def sample(
+            self,
+            count: int,
+            min_rating: Optional[int] = None,
+            max_rating: Optional[int] = None,
+            include_null_rating: bool = False,
+            tags: Optional[List[str]] = None,
+            exclude: Optional[List[str]] = None,
+            seed: Optional[int] = None
+    ) -> List[dict]:
+        tags = sorted(set(tags or []))
+        excluded = {self.snapshot.row_by_uid(uid) for uid in exclude or []}
+        excluded.discard(None)
+
+        lo = bisect_left(self.bucket_keys, rating_bucket(min_rating)) if min_rating is not None else 0
+        hi = (bisect_right(self.bucket_keys, max_rating)
+              if max_rating is not None else len(self.bucket_keys))
+        buckets: List[Optional[int]] = self.bucket_keys[lo:hi]
+        if include_null_rating:
+            buckets.append(None)
+
+        # Страты: кандидаты из каждой рейтинговой корзины
+        ratings = self.snapshot.ratings
+        strata = []
+        for bucket in buckets:
+            candidates = self._candidates(bucket, tags)
+            if bucket is not None and (min_rating is not None or max_rating is not None):
+                candidates = [
+                    row for row in candidates
+                    if (min_rating is None or ratings[row] >= min_rating)
+                    and (max_rating is None or ratings[row] <= max_rating)
+                ]
+            if excluded:
+                candidates = [row for row in candidates if row not in excluded]
+            if candidates:
+                strata.append(candidates)
+
+        # Распределяем квоту поровну между стратами
+        quotas = [0] * len(strata)
+        remaining = min(count, sum(len(stratum) for stratum in strata))
+        while remaining:
+            for i, stratum in enumerate(strata):
+                if remaining and quotas[i] < len(stratum):
+                    quotas[i] += 1
+                    remaining -= 1
+
+        rng = random.Random(seed)
+        picked = []
+        for stratum, quota in zip(strata, quotas):
+            picked.extend(rng.sample(stratum, quota))
+        rng.shuffle(picked)
+        return [self.snapshot.problem(row) for row in picked]
+
+
+class TagIndex:
+    """Отсортированный префиксный индекс тегов с количеством задач"""
+
+    def __init__(self, catalog_snapshot: CatalogSnapshot):
+        # Теги в снимке уже отсортированы по имени без учета регистра
+        self.tags = catalog_snapshot.tags
+        self.keys = [tag['name'].lower() for tag in self.tags]
+        digest = hashlib.sha1(
+            "\n".join(f"{tag['name']}:{tag['problems_count']}" for tag in self.tags).encode()
+        )
+        self.etag = f'"{digest.hexdigest()[:16]}"'
+
+    def suggest(self, prefix: str, limit: int) -> List[dict]:
+        prefix = prefix.lower()
+        lo = bisect_left(self.keys, prefix)
+        hi = bisect_left(self.keys, prefix + "\uffff")
+        matches = sorted(self.tags[lo:hi], key=lambda tag: -tag['problems_count'])
+        return matches[:limit]
+
+
+problem_sampler = CatalogCache(ProblemSampler)
+tag_index = CatalogCache(TagIndex)
@@ -0,0 +1,271 @@
+import asyncio
+import hashlib
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import crud
+from database import DATABASE_PATH
+
+# Снимок каталога только для чтения: пишется синхронизацией, каждый воркер отображает его через mmap.
+# Формат: заголовок, таблица секций и сами секции — массивы int32/uint32 в порядке байт машины
+# и UTF-8 строки. Воркеры читают массивы через memoryview без копирования.
+SNAPSHOT_DIR = os.path.join(os.path.dirname(DATABASE_PATH) or ".", "snapshots")
+CURRENT_POINTER = "CURRENT"
+# Сколько старых файлов оставлять: воркер может еще держать предыдущую версию
+KEEP_SNAPSHOTS = 3
+
+MAGIC = b"CFSNAP01"
+BYTE_ORDER = b"L" if sys.byteorder == "little" else b"B"
+_HEADER = struct.Struct("<8sc3xI")  # magic, порядок байт, число секций
+_SECTION = struct.Struct("<8sQQ")  # имя, смещение, длина
+_ALIGN = 8
+
+# Строковые колонки задачи в порядке хранения
+PROBLEM_STRINGS = ('problem_uid', 'cf_problem_index', 'name', 'problem_url')
+# Шаг рейтинговых корзин (рейтинги CF кратны 100)
+RATING_BUCKET_STEP = 100
+NULL_RATING = -1
+
+
+def rating_bucket(rating: Optional[int]) -> Optional[int]:
+    if rating is None:
+        return None
+    return rating // RATING_BUCKET_STEP * RATING_BUCKET_STEP
+
+
+def _string_table(values: List[str]) -> Tuple[array, bytes]:
+    offsets = array('I', [0])
+    data = bytearray()
+    for value in values:
+        data += (value or '').encode()
+        offsets.append(len(data))
+    return offsets, bytes(data)
+
+
+def pack_catalog(problems: List, tag_pairs: List, tags: List) -> bytes:
+    """Сборка снимка: строки задач упорядочены по (корзина рейтинга, id), NULL-рейтинг последним"""
+    rows = sorted(problems, key=lambda row: (row.rating is None, rating_bucket(row.rating) or 0, row.id))
+    row_of = {row.id: position for position, row in enumerate(rows)}
+
+    buckets = array('i')
+    for position, row in enumerate(rows):
+        bucket = rating_bucket(row.rating)
+        key = NULL_RATING if bucket is None else bucket
+        if not buckets or buckets[-3] != key:
+            buckets.extend((key, position, position))
+        buckets[-1] = position + 1
+
+    string_offsets, string_data = _string_table([getattr(row, column) for row in rows for column in PROBLEM_STRINGS])
+    by_uid = array('i', sorted(range(len(rows)), key=lambda position: rows[position].problem_uid))
+
+    postings_by_tag: Dict[str, List[int]] = {}
+    for problem_id, tag_name in tag_pairs:
+        if problem_id in row_of:
+            postings_by_tag.setdefault(tag_name, []).append(row_of[problem_id])
+    tags = sorted(tags, key=lambda tag: tag.name.lower())
+    tag_meta = array('i')
+    tag_offsets = array('I', [0])
+    postings = array('i')
+    for tag in tags:
+        tag_meta.extend((tag.id, tag.problems_count))
+        postings.extend(sorted(postings_by_tag.get(tag.name, ())))
+        tag_offsets.append(len(postings))
+    tag_name_offsets, tag_name_data = _string_table([tag.name for tag in tags])
+
+    sections = [
+        (b"ids", array('i', (row.id for row in rows)).tobytes()),
+        (b"ratings", array('i', (NULL_RATING if row.rating is None else row.rating for row in rows)).tobytes()),
+        (b"stroffs", string_offsets.tobytes()),
+        (b"strdata", string_data),
+        (b"buckets", buckets.tobytes()),
+        (b"byuid", by_uid.tobytes()),
+        (b"tagmeta", tag_meta.tobytes()),
+        (b"tagoffs", tag_offsets.tobytes()),
+        (b"tagpost", postings.tobytes()),
+        (b"tnoffs", tag_name_offsets.tobytes()),
+        (b"tndata", tag_name_data),
+    ]
+
+    header_size = _HEADER.size + _SECTION.size * len(sections)
+    out = bytearray(_HEADER.pack(MAGIC, BYTE_ORDER, len(sections)))
+    body = bytearray()
+    offset = header_size
+    for name, data in sections:
+        padding = -offset % _ALIGN
+        body += b"\0" * padding
+        offset += padding
+        out += _SECTION.pack(name, offset, len(data))
+        body += data
+        offset += len(data)
+    return bytes(out + body)
+
+
+async def build_catalog(db: AsyncSession) -> bytes:
+    problems = await crud.get_cf_problem_catalog(db)
+    tag_pairs = await crud.get_cf_problem_tag_pairs(db)
+    tags = await crud.get_cf_tag_counts(db)
+    # Упаковка — чистый CPU на сотни миллисекунд: цикл событий в это время обслуживает запросы
+    return await asyncio.get_running_loop().run_in_executor(None, pack_catalog, problems, tag_pairs, tags)
+
+
+class CatalogSnapshot:
+    """Представление снимка поверх буфера (mmap или bytes) без копирования массивов"""
+
+    def __init__(self, buffer, version: str, source: Optional[mmap.mmap] = None):
+        self.version = version
+        self._source = source  # mmap должен жить, пока живут представления
+        view = memoryview(buffer)
+        magic, byte_order, count = _HEADER.unpack_from(view, 0)
+        if magic != MAGIC or byte_order != BYTE_ORDER:
+            raise ValueError("Unsupported catalog snapshot format")
+        sections = {}
+        for i in range(count):
+            name, offset, length = _SECTION.unpack_from(view, _HEADER.size + i * _SECTION.size)
+            sections[name.rstrip(b"\0").decode()] = view[offset:offset + length]
+
+        self.ids = sections['ids'].cast('i')
+        self.ratings = sections['ratings'].cast('i')
+        self._string_offsets = sections['stroffs'].cast('I')
+        self._string_data = sections['strdata']
+        self._by_uid = sections['byuid'].cast('i')
+        self.tag_postings_data = sections['tagpost'].cast('i')
+        self._tag_offsets = sections['tagoffs'].cast('I')
+
+        # Небольшие таблицы (десятки корзин и тегов) разворачиваются в объекты сразу
+        buckets = sections['buckets'].cast('i')
+        self.buckets: Dict[Optional[int], Tuple[int, int]] = {
+            (None if buckets[i] == NULL_RATING else buckets[i]): (buckets[i + 1], buckets[i + 2])
+            for i in range(0, len(buckets), 3)
+        }
+        tag_meta = sections['tagmeta'].cast('i')
+        tag_name_offsets = sections['tnoffs'].cast('I')
+        tag_names = sections['tndata']
+        self.tags = [
+            {
+                'id': tag_meta[2 * i],
+                'name': bytes(tag_names[tag_name_offsets[i]:tag_name_offsets[i + 1]]).decode(),
+                'problems_count': tag_meta[2 * i + 1],
+            }
+            for i in range(len(tag_meta) // 2)
+        ]
+        self._tag_positions = {tag['name']: i for i, tag in enumerate(self.tags)}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _string(self, row: int, column: int) -> str:
+        i = row * len(PROBLEM_STRINGS) + column
+        return bytes(self._string_data[self._string_offsets[i]:self._string_offsets[i + 1]]).decode()
+
+    def rating(self, row: int) -> Optional[int]:
+        rating = self.ratings[row]
+        return None if rating == NULL_RATING else rating
+
+    def problem(self, row: int) -> dict:
+        problem = {'id': self.ids[row]}
+        for column, name in enumerate(PROBLEM_STRINGS):
+            problem[name] = self._string(row, column)
+        problem['rating'] = self.rating(row)
+        problem['problem_url'] = problem['problem_url'] or None
+        return problem
+
+    def row_by_uid(self, problem_uid: str) -> Optional[int]:
+        """Двоичный поиск по перестановке строк, отсортированной по problem_uid"""
+        lo, hi = 0, len(self._by_uid)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._string(self._by_uid[mid], 0) < problem_uid:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self._by_uid) and self._string(self._by_uid[lo], 0) == problem_uid:
+            return self._by_uid[lo]
+        return None
+
+    def tag_postings(self, tag: str, start: int = 0, end: Optional[int] = None):
+        """Отсортированные номера строк задач с тегом, ограниченные диапазоном [start, end)"""
+        position = self._tag_positions.get(tag)
+        if position is None:
+            return self.tag_postings_data[0:0]
+        postings = self.tag_postings_data[self._tag_offsets[position]:self._tag_offsets[position + 1]]
+        if end is None:
+            return postings
+        return postings[bisect_left(postings, start):bisect_left(postings, end)]
+
+
+# --- Файлы снимков ---
+def _pointer_path(directory: str) -> str:
+    return os.path.join(directory, CURRENT_POINTER)
+
+
+def write_snapshot_file(data: bytes, stamp: str, directory: str = SNAPSHOT_DIR) -> str:
+    """Запись новой версии и атомарное переключение указателя CURRENT.
+
+    Имя файла — хэш содержимого, поэтому одинаковый каталог дает тот же файл,
+    а несколько процессов могут писать снимок одновременно. В указателе рядом
+    с именем хранится отпечаток каталога (crud.get_cf_catalog_stamp), для
+    которого снимок собран.
+    """
+    os.makedirs(directory, exist_ok=True)
+    version = hashlib.sha1(data).hexdigest()[:16]
+    name = f"catalog-{version}.bin"
+    path = os.path.join(directory, name)
+    if not os.path.exists(path):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    tmp = f"{_pointer_path(directory)}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(f"{name}\n{stamp}\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, _pointer_path(directory))
+
+    # Удаленный файл остается доступен воркерам, которые его уже отобразили
+    old = sorted(
+        (entry for entry in os.scandir(directory)
+         if entry.name.startswith("catalog-") and entry.name.endswith(".bin") and entry.name != name),
+        key=lambda entry: entry.stat().st_mtime,
+        reverse=True
+    )
+    for entry in old[KEEP_SNAPSHOTS - 1:]:
+        os.remove(entry.path)
+    return path
+
+
+async def write_snapshot(db: AsyncSession, directory: str = SNAPSHOT_DIR) -> str:
+    # Отпечаток и строки читаются одной транзакцией, поэтому описывают одно состояние каталога
+    stamp = await crud.get_cf_catalog_stamp(db)
+    data = await build_catalog(db)
+    # fsync тоже блокирует: пишем из пула потоков
+    return await asyncio.get_running_loop().run_in_executor(None, write_snapshot_file, data, stamp, directory)
+
+
+def current_snapshot(directory: str = SNAPSHOT_DIR) -> Optional[Tuple[str, str]]:
+    """Имя текущего файла снимка и отпечаток каталога, для которого он собран"""
+    try:
+        with open(_pointer_path(directory)) as f:
+            lines = f.read().split()
+    except FileNotFoundError:
+        return None
+    if len(lines) != 2:
+        # Указатель старого формата без отпечатка проверить нельзя
+        return None
+    return lines[0], lines[1]
+
+
+def open_snapshot(name: str, directory: str = SNAPSHOT_DIR) -> CatalogSnapshot:
+    with open(os.path.join(directory, name), "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return CatalogSnapshot(mapped, name, source=mapped)
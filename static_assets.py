@@ -0,0 +1,94 @@
+import gzip
+import hashlib
+from typing import Dict, Optional
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:  # brotli необязателен: без него отдаем gzip
+    brotli = None
+
+# Страница отдается по адресу без версии и меняется при деплое: браузер должен
+# перепроверять ее каждый раз, благодаря ETag это ответ 304 без тела.
+# Долгий max-age годится только для адресов с хешем содержимого
+FRONTEND_CACHE_CONTROL = "no-cache"
+
+
+def parse_accept_encoding(header: str) -> Dict[str, float]:
+    """Заголовок Accept-Encoding в словарь {кодировка: q}; некорректный q считается отказом"""
+    weights = {}
+    for part in header.lower().split(","):
+        coding, *params = [item.strip() for item in part.split(";")]
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[coding] = min(max(q, 0.0), 1.0)
+    return weights
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Слабое сравнение If-None-Match (RFC 9110): префикс W/ не учитывается"""
+    if if_none_match.strip() == "*":
+        return True
+    return any(
+        candidate.strip().removeprefix("W/") == etag
+        for candidate in if_none_match.split(",")
+    )
+
+
+class PrecompressedAsset:
+    """Статический файл, сжатый заранее: тело, gzip, brotli и ETag по содержимому.
+
+    У каждого варианта свой ETag (хеш с суффиксом кодировки): сильный валидатор
+    обязан различать представления, иначе кеш может отдать br клиенту без brotli.
+    """
+
+    def __init__(self, body: bytes, media_type: str):
+        self.media_type = media_type
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.variants: Dict[Optional[str], bytes] = {None: body}
+        self.variants["gzip"] = gzip.compress(body, compresslevel=9, mtime=0)
+        if brotli is not None:
+            self.variants["br"] = brotli.compress(body, quality=11)
+        self.etags: Dict[Optional[str], str] = {
+            encoding: f'"{digest}-{encoding}"' if encoding else f'"{digest}"'
+            for encoding in self.variants
+        }
+
+    @classmethod
+    def from_file(cls, path: str, media_type: str = "text/html; charset=utf-8") -> "PrecompressedAsset":
+        with open(path, "rb") as f:
+            return cls(f.read(), media_type)
+
+    def choose_encoding(self, accept_encoding: str) -> Optional[str]:
+        """Кодировка с наибольшим q; при равенстве br лучше gzip. q=0 в любой записи — отказ"""
+        weights = parse_accept_encoding(accept_encoding)
+        best, best_q = None, 0.0
+        for encoding in ("br", "gzip"):
+            q = weights.get(encoding, weights.get("*", 0.0))
+            if encoding in self.variants and q > best_q:
+                best, best_q = encoding, q
+        return best
+
+    def response(self, request: Request) -> Response:
+        encoding = self.choose_encoding(request.headers.get("accept-encoding", ""))
+        headers = {
+            "ETag": self.etags[encoding],
+            "Cache-Control": FRONTEND_CACHE_CONTROL,
+            "Vary": "Accept-Encoding",
+        }
+        if etag_matches(request.headers.get("if-none-match", ""), self.etags[encoding]):
+            return Response(status_code=304, headers=headers)
+
+        if encoding is not None:
+            headers["Content-Encoding"] = encoding
+        return Response(content=self.variants[encoding], media_type=self.media_type, headers=headers)
@@ -0,0 +1,204 @@
+import time
+from datetime import date, datetime, timezone
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import select, insert, update, delete, bindparam, func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import CFSolvedCountChunk, CFSolvedCountRollup
+
+# Сколько замеров хранится в одном блоке сырых данных
+CHUNK_MAX_SAMPLES = 128
+# Политика хранения (в днях): сырые замеры и дневные агрегаты удаляются раньше остальных
+RETENTION_DAYS = {
+    'raw': 30,
+    'day': 365,
+    'week': 5 * 365,
+    'month': None,
+}
+PERIODS = ('day', 'week', 'month')
+SECONDS_PER_DAY = 86400
+
+
+# --- Кодирование ---
+def _zigzag(value: int) -> int:
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def _unzigzag(value: int) -> int:
+    return value // 2 if value % 2 == 0 else -(value + 1) // 2
+
+
+def _write_varint(out: bytearray, value: int):
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def encode_samples(samples: Iterable[Tuple[int, int]], prev_ts: int, prev_value: int) -> bytes:
+    """Кодирование пар (время, значение) как дельт от предыдущего замера"""
+    out = bytearray()
+    for ts, value in samples:
+        _write_varint(out, _zigzag(ts - prev_ts))
+        _write_varint(out, _zigzag(value - prev_value))
+        prev_ts, prev_value = ts, value
+    return bytes(out)
+
+
+def decode_samples(data: bytes, start_ts: int) -> List[Tuple[int, int]]:
+    """Обратное преобразование блока в список пар (время, значение)"""
+    samples = []
+    numbers = []
+    shift = current = 0
+    for byte in data:
+        current |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        numbers.append(_unzigzag(current))
+        shift = current = 0
+
+    ts, value = start_ts, 0
+    for i in range(0, len(numbers) - 1, 2):
+        ts += numbers[i]
+        value += numbers[i + 1]
+        samples.append((ts, value))
+    return samples
+
+
+# --- Периоды ---
+def period_start(period: str, ts: int) -> int:
+    """Номер первого дня периода (день, неделя с понедельника, месяц) от эпохи"""
+    day = ts // SECONDS_PER_DAY
+    if period == 'day':
+        return day
+    if period == 'week':
+        # 1970-01-01 был четвергом, ближайший понедельник — день 4
+        return (day - 4) // 7 * 7 + 4
+    first = date.fromordinal(date(1970, 1, 1).toordinal() + day).replace(day=1)
+    return first.toordinal() - date(1970, 1, 1).toordinal()
+
+
+def day_to_datetime(day: int) -> datetime:
+    return datetime.fromtimestamp(day * SECONDS_PER_DAY, tz=timezone.utc)
+
+
+# --- Запись ---
+async def record_solved_counts(
+        session: AsyncSession,
+        samples: List[Tuple[int, int, int]],
+        timestamp: Optional[int] = None
+):
+    """Добавление замеров (problem_id, contest_id, solved_count) в сырые блоки и агрегаты.
+
+    Ряд определяется парой (problem_id, contest_id), как и строка cf_problem_statistics.
+    В сырые блоки попадают только изменившиеся значения, агрегаты обновляются всегда.
+    """
+    if not samples:
+        return
+    ts = int(timestamp if timestamp is not None else time.time())
+    latest = {(problem_id, contest_id): value for problem_id, contest_id, value in samples}
+
+    open_chunks = {
+        (chunk.problem_id, chunk.contest_id): chunk
+        for chunk in (await session.execute(
+            select(
+                CFSolvedCountChunk.id,
+                CFSolvedCountChunk.problem_id,
+                CFSolvedCountChunk.contest_id,
+                CFSolvedCountChunk.last_ts,
+                CFSolvedCountChunk.last_value,
+                CFSolvedCountChunk.sample_count,
+                CFSolvedCountChunk.data
+            )
+            .where(
+                CFSolvedCountChunk.problem_id.in_({problem_id for problem_id, _ in latest}),
+                CFSolvedCountChunk.sample_count < CHUNK_MAX_SAMPLES
+            )
+        )).all()
+    }
+
+    appends, new_chunks = [], []
+    for series, value in latest.items():
+        chunk = open_chunks.get(series)
+        if chunk is None:
+            new_chunks.append({
+                'problem_id': series[0],
+                'contest_id': series[1],
+                'start_ts': ts,
+                'last_ts': ts,
+                'last_value': value,
+                'sample_count': 1,
+                'data': encode_samples([(ts, value)], ts, 0)
+            })
+        elif chunk.last_value != value and ts >= chunk.last_ts:
+            appends.append({
+                'chunk_id': chunk.id,
+                'last_ts': ts,
+                'last_value': value,
+                'sample_count': chunk.sample_count + 1,
+                'data': chunk.data + encode_samples([(ts, value)], chunk.last_ts, chunk.last_value)
+            })
+
+    table = CFSolvedCountChunk.__table__
+    if new_chunks:
+        await session.execute(insert(table), new_chunks)
+    if appends:
+        await session.execute(
+            update(table)
+            .where(table.c.id == bindparam('chunk_id'))
+            .values(
+                last_ts=bindparam('last_ts'),
+                last_value=bindparam('last_value'),
+                sample_count=bindparam('sample_count'),
+                data=bindparam('data')
+            ),
+            appends
+        )
+
+    rollups = CFSolvedCountRollup.__table__
+    stmt = sqlite_insert(rollups)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['problem_id', 'contest_id', 'period', 'period_start'],
+        set_={
+            'last_value': stmt.excluded.last_value,
+            'min_value': func.min(rollups.c.min_value, stmt.excluded.min_value),
+            'max_value': func.max(rollups.c.max_value, stmt.excluded.max_value),
+        }
+    )
+    await session.execute(stmt, [
+        {
+            'problem_id': problem_id,
+            'contest_id': contest_id,
+            'period': period,
+            'period_start': period_start(period, ts),
+            'first_value': value,
+            'last_value': value,
+            'min_value': value,
+            'max_value': value
+        }
+        for (problem_id, contest_id), value in latest.items()
+        for period in PERIODS
+    ])
+
+
+async def apply_retention(session: AsyncSession, timestamp: Optional[int] = None):
+    """Удаление устаревших сырых блоков и агрегатов согласно RETENTION_DAYS"""
+    now = int(timestamp if timestamp is not None else time.time())
+    raw_days = RETENTION_DAYS['raw']
+    if raw_days is not None:
+        await session.execute(
+            delete(CFSolvedCountChunk)
+            .where(CFSolvedCountChunk.last_ts < now - raw_days * SECONDS_PER_DAY)
+        )
+    for period in PERIODS:
+        days = RETENTION_DAYS[period]
+        if days is not None:
+            await session.execute(
+                delete(CFSolvedCountRollup).where(
+                    CFSolvedCountRollup.period == period,
+                    CFSolvedCountRollup.period_start < now // SECONDS_PER_DAY - days
+                )
+            )
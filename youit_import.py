@@ -0,0 +1,188 @@
+import argparse
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+from sqlalchemy import bindparam, column, insert, select, table, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import crud
+import models
+from database import AsyncSessionLocal
+from init_db import create_tables
+
+logger = logging.getLogger(__name__)
+
+# Временные таблицы с выборкой: внутренние id контестов и задач Codeforces.
+# Индексы по cf_contest_id и cf_problem_id объявлены в models и создаются init_db.
+IMPORT_SETUP_STATEMENTS = [
+    "CREATE TEMP TABLE IF NOT EXISTS import_cf_contests (contest_id INTEGER PRIMARY KEY)",
+    "CREATE TEMP TABLE IF NOT EXISTS import_cf_problems (cf_problem_id INTEGER PRIMARY KEY)",
+    "CREATE TEMP TABLE IF NOT EXISTS import_youit_problems "
+    "(cf_problem_id INTEGER PRIMARY KEY, youit_problem_id INTEGER NOT NULL)",
+    "DELETE FROM import_cf_contests",
+    "DELETE FROM import_cf_problems",
+    "DELETE FROM import_youit_problems",
+]
+
+import_cf_contests = table("import_cf_contests", column("contest_id"))
+import_cf_problems = table("import_cf_problems", column("cf_problem_id"))
+
+# Перенос выборки в таблицы YouIT. Повторный запуск ничего не дублирует:
+# контест узнается по cf_contest_id, задача — по записи в cf_problem_references.
+IMPORT_STATEMENTS = [
+    ("contests", """
+    INSERT INTO youit_contests (name, start_time, duration, is_archived, cf_contest_id)
+    SELECT COALESCE(c.name, 'Codeforces ' || c.cf_contest_id), c.start_time, c.duration, 0, c.cf_contest_id
+    FROM import_cf_contests i
+    JOIN cf_contests c ON c.id = i.contest_id
+    WHERE NOT EXISTS (SELECT 1 FROM youit_contests y WHERE y.cf_contest_id = c.cf_contest_id)
+    ORDER BY c.cf_contest_id
+    """),
+    # Идентификаторы новых задач назначаются заранее, чтобы ссылки вставлялись тем же INSERT ... SELECT
+    (None, """
+    INSERT INTO import_youit_problems (cf_problem_id, youit_problem_id)
+    SELECT p.cf_problem_id,
+           (SELECT COALESCE(MAX(id), 0) FROM youit_problems) + ROW_NUMBER() OVER (ORDER BY p.cf_problem_id)
+    FROM import_cf_problems p
+    WHERE NOT EXISTS (SELECT 1 FROM cf_problem_references r WHERE r.cf_problem_id = p.cf_problem_id)
+    """),
+    ("problems", """
+    INSERT INTO youit_problems (id, title, difficulty, problem_url)
+    SELECT n.youit_problem_id, COALESCE(cf.name, cf.problem_uid), cf.rating, cf.problem_url
+    FROM import_youit_problems n
+    JOIN cf_problems cf ON cf.id = n.cf_problem_id
+    """),
+    (None, """
+    INSERT INTO cf_problem_references (youit_problem_id, cf_problem_id)
+    SELECT youit_problem_id, cf_problem_id FROM import_youit_problems
+    """),
+    ("contest_links", """
+    INSERT OR IGNORE INTO youit_problem_contest_association (problem_id, contest_id)
+    SELECT r.youit_problem_id, y.id
+    FROM import_cf_problems p
+    JOIN cf_problem_references r ON r.cf_problem_id = p.cf_problem_id
+    JOIN cf_problem_contest_association a ON a.problem_id = p.cf_problem_id
+    JOIN import_cf_contests i ON i.contest_id = a.contest_id
+    JOIN cf_contests c ON c.id = a.contest_id
+    JOIN youit_contests y ON y.cf_contest_id = c.cf_contest_id
+    """),
+    ("language_links", """
+    INSERT OR IGNORE INTO youit_problem_language_association (problem_id, language_code)
+    SELECT r.youit_problem_id, l.language_code
+    FROM import_cf_problems p
+    JOIN cf_problem_references r ON r.cf_problem_id = p.cf_problem_id
+    JOIN cf_problem_language_association l ON l.problem_id = p.cf_problem_id
+    """),
+]
+
+
+async def select_import_scope(
+        session: AsyncSession,
+        cf_contest_ids: Optional[List[int]] = None,
+        problem_filter: Optional[dict] = None
+):
+    """Заполнение временных таблиц: контесты по cf_contest_id и/или задачи по фильтру crud"""
+    association = models.cf_problem_contest_association.c
+    if cf_contest_ids:
+        await session.execute(
+            insert(import_cf_contests).from_select(
+                ["contest_id"],
+                select(models.CFContest.id).where(models.CFContest.cf_contest_id.in_(bindparam("ids", expanding=True)))
+            ),
+            {"ids": list(cf_contest_ids)}
+        )
+
+    if problem_filter is not None:
+        problems = (
+            crud.cf_problems_query(skip=0, limit=None, **problem_filter)
+            .with_only_columns(models.CFProblem.id)
+            .order_by(None)
+        )
+        if cf_contest_ids:
+            problems = problems.where(
+                models.CFProblem.id.in_(
+                    select(association.problem_id)
+                    .join(import_cf_contests, import_cf_contests.c.contest_id == association.contest_id)
+                )
+            )
+    else:
+        problems = (
+            select(association.problem_id)
+            .join(import_cf_contests, import_cf_contests.c.contest_id == association.contest_id)
+        )
+    await session.execute(
+        insert(import_cf_problems).prefix_with("OR IGNORE").from_select(["cf_problem_id"], problems)
+    )
+
+    if not cf_contest_ids:
+        # Контесты берутся те, в которых встречаются отобранные задачи
+        await session.execute(
+            insert(import_cf_contests).prefix_with("OR IGNORE").from_select(
+                ["contest_id"],
+                select(association.contest_id).distinct()
+                .join(import_cf_problems, import_cf_problems.c.cf_problem_id == association.problem_id)
+            )
+        )
+
+
+async def import_cf_contests_to_youit(
+        session: AsyncSession,
+        cf_contest_ids: Optional[List[int]] = None,
+        problem_filter: Optional[dict] = None
+) -> Dict[str, int]:
+    """Импорт контестов и задач Codeforces в таблицы YouIT набором INSERT ... SELECT.
+
+    Коммит остается за вызывающим, поэтому весь импорт проходит одной транзакцией.
+    Возвращает количество созданных строк по видам.
+    """
+    if not cf_contest_ids and problem_filter is None:
+        raise ValueError("Nothing to import: pass cf_contest_ids or problem_filter")
+
+    for statement in IMPORT_SETUP_STATEMENTS:
+        await session.execute(text(statement))
+    await select_import_scope(session, cf_contest_ids, problem_filter)
+
+    created = {}
+    for name, statement in IMPORT_STATEMENTS:
+        result = await session.execute(text(statement))
+        if name is not None:
+            created[name] = result.rowcount
+    return created
+
+
+async def main(cf_contest_ids: Optional[List[int]], problem_filter: Optional[dict]):
+    await create_tables()
+    async with AsyncSessionLocal() as session:
+        created = await import_cf_contests_to_youit(session, cf_contest_ids, problem_filter)
+        await session.commit()
+    logger.info(f"Import completed: {created}")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Импорт контестов Codeforces в контесты YouIT")
+    arg_parser.add_argument("contests", nargs="*", type=int, help="cf_contest_id импортируемых контестов")
+    arg_parser.add_argument("--name", help="Фильтр по названию задачи")
+    arg_parser.add_argument("--min-rating", type=int, help="Минимальный рейтинг задачи")
+    arg_parser.add_argument("--max-rating", type=int, help="Максимальный рейтинг задачи")
+    arg_parser.add_argument("--include-null-rating", action="store_true", help="Включать задачи без рейтинга")
+    arg_parser.add_argument("--tag", action="append", dest="tags", help="Тег задачи (можно несколько)")
+    arg_parser.add_argument("--min-solved-count", type=int, help="Минимальное количество решений")
+    args = arg_parser.parse_args()
+
+    filters = {
+        "name": args.name,
+        "min_rating": args.min_rating,
+        "max_rating": args.max_rating,
+        "tags": args.tags,
+        "min_solved_count": args.min_solved_count,
+    }
+    problem_filter = None
+    if any(value is not None for value in filters.values()) or args.include_null_rating:
+        problem_filter = dict(filters, include_null_rating=args.include_null_rating)
+    if not args.contests and problem_filter is None:
+        arg_parser.error("pass contest ids or at least one problem filter")
+
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger('sqlalchemy.engine').setLevel(logging.WARNING)
+    asyncio.run(main(args.contests, problem_filter))